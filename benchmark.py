@@ -0,0 +1,221 @@
+"""
+HRM 平台效能基準測試腳本。
+
+預設使用獨立的 SQLite 暫存資料庫，不會影響實際資料。設定 BENCHMARK_DATABASE_URL
+可改用其他資料庫 (例如 PostgreSQL)；注意該資料庫的表格會被清空重建。執行方式：
+
+    python benchmark.py indexes --rows 100000
+    python benchmark.py inserts --rows 2000
+    python benchmark.py serialization --rows 100000
+    python benchmark.py compression --rows 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+# 必須在匯入 main 之前設定，讓應用程式連線到暫存資料庫
+BENCH_DB_PATH = os.path.join(tempfile.gettempdir(), "hrm_benchmark.db")
+os.environ["DATABASE_URL"] = os.getenv("BENCHMARK_DATABASE_URL", f"sqlite:///{BENCH_DB_PATH}")
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from sqlmodel import Session, SQLModel, select  # noqa: E402
+
+import main  # noqa: E402
+from main import Employee  # noqa: E402
+
+DEPARTMENTS = ["研發部", "行銷部", "財務部", "人資部", "業務部", "法務部", "客服部", "資訊部"]
+POSITIONS = ["工程師", "高級工程師", "專員", "主管", "經理", "助理", "顧問", "總監"]
+SURNAMES = "陳林黃張李王吳劉蔡楊許鄭謝郭洪曾邱廖賴周"
+
+
+# --- 工具函式 ---
+
+def reset_database():
+    """刪除並重建基準測試資料庫的表格與索引。"""
+    SQLModel.metadata.drop_all(main.engine)
+    main.create_db_and_tables()
+
+def random_employees(rows: int, prefix: str = "E") -> list:
+    """產生 rows 筆隨機員工資料 (員工編號以 prefix 開頭)。"""
+    rng = random.Random(42)
+    return [
+        {
+            "employee_code": f"{prefix}{i:07d}",
+            "name": rng.choice(SURNAMES) + "".join(rng.choice(SURNAMES) for _ in range(2)),
+            "position": rng.choice(POSITIONS),
+            "department": rng.choice(DEPARTMENTS),
+            "salary": rng.randrange(30000, 200000, 500),
+        }
+        for i in range(rows)
+    ]
+
+def seed_employees(rows: int):
+    """以 executemany 寫入 rows 筆隨機員工資料。"""
+    with main.engine.begin() as connection:
+        connection.execute(Employee.__table__.insert(), random_employees(rows))
+
+def timed(func, repeat: int) -> float:
+    """執行 func repeat 次，回傳每次平均耗時 (毫秒)。"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+# --- 基準測試：搜尋索引 ---
+
+# 代表性查詢：與 GET /employees 的篩選參數相同
+INDEX_QUERIES = {
+    "department + salary 範圍": dict(department="研發部", salary_min=80000, salary_max=120000),
+    "position": dict(position="經理"),
+    "姓名/編號前綴 (q)": dict(q="陳林"),
+}
+
+def query_plan(session: Session, statement) -> str:
+    compiled = statement.compile(main.engine, compile_kwargs={"literal_binds": True})
+    if main.engine.dialect.name == "sqlite":
+        rows = session.connection().exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+        return "; ".join(row[-1] for row in rows)
+    rows = session.connection().exec_driver_sql(f"EXPLAIN {compiled}").all()
+    return " / ".join(row[0].strip() for row in rows)
+
+def run_queries(label: str, repeat: int):
+    print(f"\n[{label}]")
+    with Session(main.engine) as session:
+        for name, params in INDEX_QUERIES.items():
+            # 與 GET /employees 的預設查詢相同：ORDER BY id LIMIT 每頁筆數 + 1
+            statement = (
+                select(Employee)
+                .where(*main.build_employee_filters(**params))
+                .order_by(Employee.id)
+                .limit(main.EMPLOYEES_PAGE_SIZE + 1)
+            )
+            elapsed = timed(lambda: session.exec(statement).all(), repeat)
+            print(f"  {name:<24} {elapsed:8.3f} ms  計畫: {query_plan(session, statement)}")
+
+def bench_indexes(args):
+    """比較無索引與宣告索引下的查詢計畫與延遲。"""
+    reset_database()
+    seed_employees(args.rows)
+    print(f"已寫入 {args.rows} 筆員工資料")
+
+    # 只保留主鍵與 employee_code 唯一索引 (即加入搜尋索引前的狀態)
+    declared = [index for index in Employee.__table__.indexes if index.name != "ix_employee_employee_code"]
+    with main.engine.begin() as connection:
+        for index in declared:
+            index.drop(connection, checkfirst=True)
+        connection.exec_driver_sql("ANALYZE")
+    run_queries("未建立搜尋索引", args.repeat)
+
+    main.create_db_and_tables()
+    with main.engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    run_queries("已建立搜尋索引", args.repeat)
+
+
+# --- 基準測試：單筆新增 ---
+
+async def insert_with_refresh(employees: list):
+    """舊做法：session.add + commit + refresh (每筆多一次 SELECT 取得主鍵)。"""
+    for data in employees:
+        async with main.async_session_factory() as session:
+            employee = Employee(**data)
+            session.add(employee)
+            await session.exec(main.BUMP_TABLE_VERSION)
+            await session.commit()
+            await session.refresh(employee)
+
+async def insert_returning(employees: list):
+    """新做法：與 create_employee 相同，以 INSERT ... RETURNING 一次取得完整資料列。"""
+    for data in employees:
+        async with main.async_session_factory() as session:
+            statement = insert(Employee).values(**data).returning(*Employee.__table__.c)
+            row = (await session.exec(statement)).mappings().one()
+            await session.exec(main.BUMP_TABLE_VERSION)
+            await session.commit()
+            Employee.model_validate(dict(row))
+
+def bench_inserts(args):
+    """比較 POST /employees 舊 (add + refresh) 與新 (INSERT ... RETURNING) 寫入路徑的每秒新增筆數。"""
+    reset_database()
+    for prefix, (label, insert_func) in zip("RN", [("add + commit + refresh", insert_with_refresh), ("INSERT ... RETURNING", insert_returning)]):
+        employees = random_employees(args.rows, prefix)
+        start = time.perf_counter()
+        asyncio.run(insert_func(employees))
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<24} {args.rows / elapsed:10.1f} 筆/秒  ({elapsed * 1000 / args.rows:.3f} ms/筆)")
+    asyncio.run(main.async_engine.dispose())
+
+
+# --- 基準測試：清單序列化 ---
+
+def bench_serialization(args):
+    """比較 GET /employees 預設路徑 (ORM 物件 + response_model) 與快速路徑 (欄位 tuple + orjson) 的每秒輸出筆數。"""
+    reset_database()
+    seed_employees(args.rows)
+    print(f"已寫入 {args.rows} 筆員工資料，每次請求取回全部資料")
+    # 放寬每頁上限，讓單一請求涵蓋所有資料以突顯序列化成本
+    main.EMPLOYEES_PAGE_SIZE_MAX = args.rows
+    repeat = max(1, args.repeat // 4)
+    with TestClient(main.app) as client:
+        for label, fast in [("ORM + response_model", False), ("欄位 tuple + orjson", True)]:
+            main.EMPLOYEES_FAST_JSON = fast
+            size = len(client.get("/employees", params={"limit": args.rows}).content)
+            elapsed = timed(lambda: client.get("/employees", params={"limit": args.rows}), repeat)
+            print(f"  {label:<24} {args.rows * 1000 / elapsed:12.0f} 筆/秒  ({elapsed:9.1f} ms/請求, {size} bytes)")
+
+
+# --- 基準測試：回應壓縮 ---
+
+def bench_compression(args):
+    """比較 GET /employees 在不同壓縮方式下的傳輸位元組數與壓縮 CPU 成本 (資料量為 rows/10 與 rows)。"""
+    main.EMPLOYEES_PAGE_SIZE_MAX = args.rows
+    encodings = ["identity", "gzip"] + (["br"] if main.brotli is not None else [])
+    formats = [("JSON", "application/json"), ("欄位導向", main.COLUMNAR_MEDIA_TYPE)]
+    repeat = max(1, args.repeat // 4)
+    for rows in sorted({max(1, args.rows // 10), args.rows}):
+        reset_database()
+        seed_employees(rows)
+        print(f"\n[{rows} 筆]")
+        with TestClient(main.app) as client:
+            for format_name, media_type in formats:
+                body = client.get("/employees", params={"limit": rows}, headers={"Accept": media_type, "Accept-Encoding": "identity"}).content
+                for encoding in encodings:
+                    if encoding == "identity":
+                        size, cpu = len(body), 0.0
+                    else:
+                        size = len(main.compress_body(body, encoding))
+                        start = time.process_time()
+                        for _ in range(repeat):
+                            main.compress_body(body, encoding)
+                        cpu = (time.process_time() - start) * 1000 / repeat
+                    print(f"  {format_name:<6} {encoding:<8} {size:>12} bytes  ({size / len(body):6.1%})  壓縮 CPU {cpu:8.1f} ms")
+
+
+BENCHMARKS = {
+    "indexes": bench_indexes,
+    "inserts": bench_inserts,
+    "serialization": bench_serialization,
+    "compression": bench_compression,
+}
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="HRM 平台效能基準測試")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS), help="要執行的基準測試")
+    parser.add_argument("--rows", type=int, default=100_000, help="測試資料筆數")
+    parser.add_argument("--repeat", type=int, default=20, help="每個測量重複次數")
+    args = parser.parse_args()
+    try:
+        BENCHMARKS[args.benchmark](args)
+    finally:
+        SQLModel.metadata.drop_all(main.engine)
+        main.engine.dispose()
+        if os.path.exists(BENCH_DB_PATH):
+            os.remove(BENCH_DB_PATH)
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,20 +1,75 @@
 import uuid
 import csv
 import os
-from io import StringIO
-from typing import List, Dict, Optional
+import json
+import base64
+import hashlib
+import asyncio
+import binascii
+import gzip
+import re
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from io import StringIO, TextIOWrapper
+from typing import Any, List, Dict, Literal, Optional, Tuple
 # 引入 Depends (依賴注入)、Session (資料庫會話)
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends 
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
 # 引入 SQLModel 相關函式庫
 from sqlmodel import SQLModel, Field, create_engine, Session, select 
-from pydantic import BaseModel, field_validator
+from sqlmodel.ext.asyncio.session import AsyncSession
+from pydantic import BaseModel, ValidationError, field_validator
+import orjson
+# brotli 為選用套件：未安裝時僅提供 gzip 壓縮
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from prometheus_client import CONTENT_TYPE_LATEST, Counter as MetricCounter, Gauge, Histogram, generate_latest
+from sqlalchemy import (
+    DDL, JSON, Column, DateTime, Index, Integer, MetaData, String, Table,
+    and_, bindparam, case, delete, event, exists, func, insert, inspect, or_, text, update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlalchemy.exc import IntegrityError # 用於捕捉資料庫唯一性錯誤
 
 # --- 1. 定義資料模型 (SQLModel) ---
 
 # 員工資料的資料庫模型 (對應到資料庫表格 table=True)
 class Employee(SQLModel, table=True):
+    # 查詢用索引：部門+薪資 (篩選與範圍查詢)、職位，以及姓名/員工編號搜尋索引
+    # 搜尋索引依資料庫而異：PostgreSQL 使用 pg_trgm GIN 索引 (支援前綴與子字串 ILIKE，不受定序影響)；
+    # SQLite 使用 NOCASE 索引，讓大小寫不敏感的 LIKE 'x%' 可走索引。
+    # q 以 OR 同時比對兩個欄位，兩者都必須有可用索引，資料庫才能合併索引結果而非全表掃描
+    __table_args__ = (
+        Index("ix_employee_department_salary", "department", "salary"),
+        Index("ix_employee_position", "position"),
+        Index(
+            "ix_employee_name_trgm", "name",
+            postgresql_using="gin", postgresql_ops={"name": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_employee_code_trgm", "employee_code",
+            postgresql_using="gin", postgresql_ops={"employee_code": "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        Index("ix_employee_name_nocase", text("name COLLATE NOCASE")).ddl_if(dialect="sqlite"),
+        Index("ix_employee_code_nocase", text("employee_code COLLATE NOCASE")).ddl_if(dialect="sqlite"),
+    )
+
     # ID：資料庫自動生成的主鍵，型別為 int
     id: Optional[int] = Field(default=None, primary_key=True) 
     
@@ -25,6 +80,8 @@ class Employee(SQLModel, table=True):
     position: str = Field(nullable=False) # 職位
     department: str = Field(nullable=False) # 部門
     salary: int = Field(gt=0, nullable=False) # 薪資 (確保大於 0)
+    # 版本號 (樂觀鎖)：每次更新遞增；server_default 讓批次寫入與既有資料也有初始值
+    version: int = Field(default=1, nullable=False, sa_column_kwargs={"server_default": text("1")})
 
 # 用於 API 請求時的輸入模型 (不包含 id)
 class EmployeeCreate(SQLModel):
@@ -32,7 +89,7 @@ class EmployeeCreate(SQLModel):
     employee_code: str 
     position: str 
     department: str 
-    salary: int
+    salary: int = Field(gt=0) # 與 Employee 相同：薪資必須大於 0
 
     # 驗證所有字串欄位不能為空 (針對輸入)
     @field_validator('name', 'employee_code', 'position', 'department', mode='before')
@@ -42,6 +99,124 @@ class EmployeeCreate(SQLModel):
             raise ValueError('此欄位不能為空')
         return value
 
+# 用於 PATCH 的部分更新模型：僅包含要變更的欄位，提供的欄位同樣不能為空
+class EmployeeUpdate(SQLModel):
+    name: Optional[str] = None
+    employee_code: Optional[str] = None
+    position: Optional[str] = None
+    department: Optional[str] = None
+    salary: Optional[int] = Field(default=None, gt=0) # 與 Employee 相同：薪資必須大於 0
+
+    # 未提供的欄位不會觸發驗證；明確傳入 null 或空字串則拒絕
+    @field_validator('name', 'employee_code', 'position', 'department', 'salary', mode='before')
+    @classmethod
+    def check_non_empty_value(cls, value):
+        if value is None or (isinstance(value, str) and not value.strip()):
+            raise ValueError('此欄位不能為空')
+        return value
+
+# 批次上傳暫存表：分批提交但需「全有或全無」時，資料先寫入此表，最後一次合併至 employee
+class EmployeeUploadStaging(SQLModel, table=True):
+    __tablename__ = "employee_upload_staging"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    import_id: str = Field(index=True, nullable=False) # 所屬上傳批次
+    row_num: int = Field(nullable=False) # CSV 列號 (用於錯誤回報)
+    employee_code: str = Field(nullable=False)
+    name: str = Field(nullable=False)
+    position: str = Field(nullable=False)
+    department: str = Field(nullable=False)
+    salary: int = Field(nullable=False)
+
+# 員工表格版本計數器 (單列)：每次寫入員工資料時遞增，作為清單 ETag 的依據
+class EmployeeTableVersion(SQLModel, table=True):
+    __tablename__ = "employee_table_version"
+
+    id: int = Field(default=1, primary_key=True)
+    version: int = Field(default=0, nullable=False)
+
+# 員工變更紀錄：新增 / 更新 / 刪除各寫入一列，seq 依提交順序遞增，供用戶端增量同步
+class EmployeeChange(SQLModel, table=True):
+    __tablename__ = "employee_change"
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    employee_id: int = Field(nullable=False)
+    op: str = Field(nullable=False) # insert / update / delete
+
+# 員工清單的分頁回應模型 (Keyset 分頁)
+class EmployeePage(SQLModel):
+    items: List[Employee]
+    # 下一頁的不透明游標；為 None 代表已無更多資料
+    next_cursor: Optional[str] = None
+
+# 批次操作 (POST /employees:batch) 的單一項目
+class EmployeeBatchOperation(SQLModel):
+    op: Literal["create", "update", "delete"]
+    id: Optional[int] = None # update / delete 的目標員工 ID
+    data: Optional[Dict[str, Any]] = None # create 需提供完整欄位；update 只需提供要變更的欄位
+
+# 批次操作的逐項結果；status 與對應單筆 API 的 HTTP 狀態碼一致
+class EmployeeBatchResult(SQLModel):
+    index: int
+    op: str
+    status: int
+    id: Optional[int] = None
+    employee: Optional[Employee] = None
+    error: Optional[str] = None
+
+class EmployeeBatchResponse(SQLModel):
+    committed: bool
+    message: str
+    results: List[EmployeeBatchResult]
+
+# 變更紀錄的單一項目；employee 為該員工目前的資料 (已刪除時為 None)
+class EmployeeChangeEntry(SQLModel):
+    seq: int
+    op: str
+    employee_id: int
+    employee: Optional[Employee] = None
+
+# GET /employees/changes 回應：以 last_seq 作為下一次查詢的 since
+class EmployeeChangePage(SQLModel):
+    changes: List[EmployeeChangeEntry]
+    last_seq: int
+    has_more: bool
+
+# 批次刪除 (DELETE /employees) 的回應
+class EmployeeBulkDeleteResult(SQLModel):
+    deleted: int
+    ids: List[int]
+
+# 背景匯入工作的狀態 (GET /upload/jobs/{job_id} 回應)
+# 存放於資料庫，多個 worker 程序時任一程序都能回報進度；處理中的進度由執行該工作的程序定期寫入
+# owner 記錄負責的程序，heartbeat_at 為該程序最後一次回報的時間，用於辨識程序中止後殘留的工作
+class UploadJob(SQLModel, table=True):
+    __tablename__ = "upload_job"
+
+    id: str = Field(primary_key=True)
+    status: str = Field(default="pending", nullable=False) # pending / running / completed / failed
+    mode: str = Field(default="insert", nullable=False)
+    batch_size: Optional[int] = None
+    atomic: bool = Field(default=False, nullable=False)
+    filename: Optional[str] = None
+    # 進度：已讀取位元組 / 檔案大小，以及已讀取的 CSV 列數 (含標頭)
+    bytes_total: int = Field(default=0, nullable=False)
+    bytes_processed: int = Field(default=0, nullable=False)
+    rows_processed: int = Field(default=0, nullable=False)
+    rows_per_second: Optional[float] = None
+    created_at: datetime = Field(sa_type=DateTime(timezone=True), nullable=False, index=True)
+    started_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+    finished_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+    owner: Optional[str] = None # 主機名稱:PID:啟動識別碼
+    heartbeat_at: Optional[datetime] = Field(default=None, sa_type=DateTime(timezone=True))
+    # 完成後的結果 (欄位與 POST /upload 回應相同)；errors 於處理期間定期寫入
+    message: Optional[str] = None
+    successful_uploads: Optional[int] = None
+    inserted: Optional[int] = None
+    updated: Optional[int] = None
+    unchanged: Optional[int] = None
+    errors: List[Dict] = Field(default_factory=list, sa_type=JSON, nullable=False)
+
 # --- 2. 應用程式初始化與配置 (資料庫連線) ---
 
 app = FastAPI(
@@ -58,8 +233,103 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# --- 回應壓縮 ---
+
+# 小於門檻的回應壓縮效益低於 CPU 成本，直接送出
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+# 逐段送出的串流格式：壓縮需緩衝資料，會增加延遲，因此一律不壓縮
+COMPRESSION_EXCLUDED_TYPES = ("application/x-ndjson", "text/event-stream")
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """依 Accept-Encoding 選擇壓縮方式：優先 brotli (需已安裝)，其次 gzip；都不接受時回傳 None。"""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+def compress_body(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+class CompressionMiddleware:
+    """
+    依 Accept-Encoding 以 brotli 或 gzip 壓縮回應 (ASGI 中介層)。
+    只壓縮一次送出完整內容、大小達門檻且尚未編碼的回應；分段送出的串流回應 (例如 NDJSON 匯出) 原樣轉送。
+    壓縮在執行緒池中進行，大型清單不會阻塞事件迴圈。
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", "")) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                # 延後送出標頭，待看到第一段內容後再決定是否壓縮
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough or start_message is None:
+                await send(message)
+                return
+
+            start, start_message = start_message, None
+            headers = MutableHeaders(raw=start["headers"])
+            body = message.get("body", b"")
+            media_type = headers.get("content-type", "").split(";")[0].strip()
+            if (
+                message.get("more_body", False)
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or media_type in COMPRESSION_EXCLUDED_TYPES
+            ):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            compressed = await run_in_threadpool(compress_body, body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            # 壓縮後的位元組不同於原始內容，依慣例將強 ETag 改為弱 ETag
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed, "more_body": False})
+
+        await self.app(scope, receive, send_wrapper)
+
+# 於監控指標中介層之內執行，讓請求延遲包含壓縮時間
+app.add_middleware(CompressionMiddleware)
+
 # 【移除】舊的記憶體內儲存 db: Dict[str, Employee] = {}
 # 【移除】舊的編號映射 code_to_id: Dict[str, str] = {}
 # 【移除】預設範例資料 initial_employees
@@ -67,149 +337,795 @@ app.add_middleware(
 # 【新增】資料庫連線設定
 # 從環境變數讀取連線字串 (來自 docker-compose.yml)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db") 
-engine = create_engine(DATABASE_URL, echo=False) # 建立連線引擎
 
-def create_db_and_tables():
-    """使用 SQLModel 創建資料庫中的所有表格。"""
-    SQLModel.metadata.create_all(engine)
+# 【新增】連線池設定 (可透過環境變數覆寫；未設定時依資料庫類型採用預設值)
+# DB_POOL_SIZE / DB_MAX_OVERFLOW：常駐連線數與尖峰時可額外建立的連線數 (每個 uvicorn worker 各自擁有連線池)
+# DB_POOL_TIMEOUT：連線池耗盡時等待可用連線的秒數
+# DB_POOL_RECYCLE：連線使用超過此秒數即重建 (-1 表示不重建)
+# DB_POOL_PRE_PING：取出連線前先檢查是否仍有效
+POOL_DEFAULTS = {
+    "postgresql": {"pool_size": 5, "max_overflow": 10, "pool_timeout": 30, "pool_recycle": 1800, "pool_pre_ping": True},
+    "sqlite": {"pool_size": 5, "max_overflow": 10, "pool_timeout": 30, "pool_recycle": -1, "pool_pre_ping": False},
+}
+# SQLite 等待寫入鎖的毫秒數 (WAL 模式下讀寫可並行，但同時只能有一個寫入者)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
 
-def get_session():
-    """依賴注入函式：管理資料庫會話的生命週期。"""
-    with Session(engine) as session:
-        yield session
+class PoolWaitStats:
+    """累計從連線池取得連線所花費的等待時間 (由 CheckoutTimingPool 記錄)。"""
 
-@app.on_event("startup")
-def on_startup():
-    """應用程式啟動時，自動建立資料庫表格 (如果不存在)。"""
-    create_db_and_tables()
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
 
-# --- 3. API 路由 (Routes) ---
-# main.py - 調整 GET 路由
+    def record(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
 
-@app.get("/", summary="健康檢查", tags=["系統"])
-def read_root():
-    """系統健康檢查點。"""
-    return {"message": "HRM API 運作中"}
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "total_seconds": round(self.total_seconds, 6),
+                "max_seconds": round(self.max_seconds, 6),
+            }
 
-@app.get("/employees", response_model=List[Employee], summary="獲取所有員工", tags=["員工管理"])
-# 透過 Depends(get_session) 注入資料庫會話
-def get_employees(session: Session = Depends(get_session)): 
-    """返回所有員工清單。"""
-    # 使用 select 查詢所有員工
-    employees = session.exec(select(Employee)).all()
-    return employees
+pool_wait_stats = {"sync": PoolWaitStats(), "async": PoolWaitStats()}
 
-@app.get("/employees/{employee_id}", response_model=Employee, summary="獲取單一員工", tags=["員工管理"])
-# ID 型別改為 int
-def get_employee(employee_id: int, session: Session = Depends(get_session)): 
-    """根據 ID 獲取特定員工資料。"""
-    # 使用 session.get 透過主鍵查詢
-    employee = session.get(Employee, employee_id)
-    if not employee:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    return employee
+# 目前這次取出連線期間建立新連線所花費的時間 (自等待時間中扣除)
+_pool_connect_seconds: ContextVar[float] = ContextVar("pool_connect_seconds", default=0.0)
 
-# main.py - 調整 POST 路由
+class CheckoutTimingPool:
+    """
+    連線池混入類別：記錄從池中取得連線的等待時間。
+    只計入 _do_get (排隊等待可用連線)，扣除期間建立新連線的時間；pre-ping 於 _do_get 之後執行，不列入。
+    會話不需預先取得連線即可量測，連線仍於第一次查詢時才取出。
+    """
+    wait_stats: PoolWaitStats
 
-@app.post("/employees", response_model=Employee, status_code=201, summary="新增員工", tags=["員工管理"])
-# 使用 EmployeeCreate 作為輸入模型
-def create_employee(employee: EmployeeCreate, session: Session = Depends(get_session)): 
-    """新增一名新員工，員工編號必須唯一。"""
-    
-    # 創建新的 Employee 物件
-    new_employee = Employee.model_validate(employee)
-    
-    try:
-        session.add(new_employee)
-        session.commit() # 提交事務，寫入資料庫
-        session.refresh(new_employee) # 重新整理物件以獲得資料庫生成的主鍵 ID
-    except IntegrityError:
-        # 捕捉資料庫唯一性錯誤
-        session.rollback()
-        raise HTTPException(status_code=400, detail=f"員工編號 {employee.employee_code} 已存在。")
-    except Exception as e:
-        session.rollback()
-        raise HTTPException(status_code=500, detail=f"內部資料儲存錯誤: {e}")
-        
-    return new_employee
+    def _do_get(self):
+        token = _pool_connect_seconds.set(0.0)
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_stats.record(max(time.perf_counter() - started - _pool_connect_seconds.get(), 0.0))
+            _pool_connect_seconds.reset(token)
 
-# main.py - 調整 PUT 路由
+    def _create_connection(self):
+        started = time.perf_counter()
+        try:
+            return super()._create_connection()
+        finally:
+            _pool_connect_seconds.set(_pool_connect_seconds.get() + time.perf_counter() - started)
+
+def checkout_timing_pool(base, wait_stats: PoolWaitStats):
+    """產生記錄等待時間至 wait_stats 的連線池類別 (沿用原類別名稱，供 /system/pool 顯示)。"""
+    return type(base.__name__, (CheckoutTimingPool, base), {"wait_stats": wait_stats})
+
+def engine_options(url: str, poolclass=None) -> Dict:
+    """依資料庫類型產生 create_engine / create_async_engine 的連線池參數；poolclass 為檔案型資料庫使用的連線池類別。"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # 記憶體資料庫使用單一連線，不適用連線池參數
+        return {"connect_args": {"check_same_thread": False}}
+
+    defaults = POOL_DEFAULTS.get(backend, POOL_DEFAULTS["postgresql"])
+    options = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", defaults["pool_size"])),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", defaults["max_overflow"])),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", defaults["pool_timeout"])),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", defaults["pool_recycle"])),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", str(defaults["pool_pre_ping"])).lower() in ("1", "true", "yes"),
+    }
+    if poolclass is not None:
+        options["poolclass"] = poolclass
+    if backend == "sqlite":
+        # 連線會在執行緒池與背景工作執行緒之間共用
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """SQLite 連線建立時啟用 WAL，讓讀取不會被批次寫入阻塞。"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+engine = create_engine(DATABASE_URL, echo=False, **engine_options(DATABASE_URL, checkout_timing_pool(QueuePool, pool_wait_stats["sync"]))) # 建立連線引擎 (同步：建表、批次上傳、串流匯出)
+
+def to_async_database_url(url: str) -> str:
+    """將同步連線字串轉換為對應的非同步驅動 (PostgreSQL → asyncpg，SQLite → aiosqlite)。"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend == "postgresql" and parsed.get_driver_name() != "asyncpg":
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    elif backend == "sqlite" and parsed.get_driver_name() != "aiosqlite":
+        parsed = parsed.set(drivername="sqlite+aiosqlite")
+    return parsed.render_as_string(hide_password=False)
+
+# 【新增】非同步連線引擎：員工 CRUD 路由在事件迴圈上執行，不佔用執行緒池
+# 可透過 ASYNC_DATABASE_URL 明確指定，否則由 DATABASE_URL 自動轉換
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_database_url(DATABASE_URL)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, echo=False,
+    **engine_options(ASYNC_DATABASE_URL, checkout_timing_pool(AsyncAdaptedQueuePool, pool_wait_stats["async"])),
+)
+# expire_on_commit=False：提交後仍可直接讀取物件屬性，不會觸發非同步環境下不允許的延遲載入
+async_session_factory = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+for _engine in (engine, async_engine.sync_engine):
+    if _engine.dialect.name == "sqlite" and make_url(str(_engine.url)).database not in (None, "", ":memory:"):
+        event.listen(_engine, "connect", configure_sqlite_connection)
+
+def pool_status(target_engine, wait_stats: PoolWaitStats) -> Dict:
+    """回傳連線池目前的使用量 (checked-out / overflow) 與累計等待時間。"""
+    pool = target_engine.pool
+    status = {"pool_class": type(pool).__name__, "checkout_wait": wait_stats.snapshot()}
+    # 僅 QueuePool 系列提供容量相關數值
+    if hasattr(pool, "checkedout"):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout(),
+        })
+    return status
+
+# --- 監控指標 (Prometheus) ---
+
+REQUEST_LATENCY = Histogram(
+    "hrm_http_request_duration_seconds", "HTTP 請求處理時間 (秒)", ["method", "route", "status"],
+)
+REQUEST_ERRORS = MetricCounter(
+    "hrm_http_request_errors_total", "回應狀態碼為 5xx 或未處理例外的請求數", ["method", "route", "status"],
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "hrm_db_queries_per_request", "每個請求執行的 SQL 語句數", ["route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500, 1000),
+)
+DB_QUERY_DURATION = Histogram(
+    "hrm_db_query_duration_seconds", "單一 SQL 語句執行時間 (秒)", ["route"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+ROWS_RETURNED = MetricCounter("hrm_employee_rows_returned_total", "員工查詢回傳的資料列數", ["route"])
+UPLOAD_ROWS = MetricCounter("hrm_upload_rows_total", "批次上傳處理的資料列數", ["mode", "outcome"])
+UPLOAD_THROUGHPUT = Histogram(
+    "hrm_upload_rows_per_second", "批次上傳吞吐量 (列/秒)", ["mode"],
+    buckets=(100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000),
+)
+POOL_GAUGE = Gauge("hrm_db_pool_connections", "資料庫連線池狀態", ["engine", "state"])
+POOL_WAIT_SECONDS = Gauge("hrm_db_pool_checkout_wait_seconds_total", "從連線池取得連線的累計等待時間 (秒)", ["engine"])
+POOL_WAIT_MAX = Gauge("hrm_db_pool_checkout_wait_seconds_max", "從連線池取得連線的最長等待時間 (秒)", ["engine"])
+
+class RequestDbStats:
+    """單一請求內各 SQL 語句的執行時間 (請求結束時才知道路由，因此先暫存)。"""
+
+    def __init__(self):
+        self.durations: List[float] = []
+
+# 目前請求的 SQL 統計；不在請求範圍內 (如背景工作) 時為 None
+request_db_stats: ContextVar[Optional[RequestDbStats]] = ContextVar("request_db_stats", default=None)
+
+# 開始時間存放於該語句的執行環境 (ExecutionContext)：語句失敗時隨之捨棄，不會在連線上累積
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+def _record_query_duration(context):
+    started = getattr(context, "query_started", None)
+    stats = request_db_stats.get()
+    if started is not None and stats is not None:
+        stats.durations.append(time.perf_counter() - started)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_query_duration(context)
+
+def _handle_error(exception_context):
+    # 失敗的語句不會觸發 after_cursor_execute，同樣計入請求的 SQL 統計
+    _record_query_duration(exception_context.execution_context)
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(_engine, "handle_error", _handle_error)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """
+    記錄每個請求的處理時間、SQL 語句數與錯誤數 (依路由樣板分類，避免 ID 造成標籤爆量)。
+    於回應內容送完後才記錄，串流回應 (例如 NDJSON 匯出) 在送出期間執行的查詢也會計入。
+    """
+    stats = RequestDbStats()
+    request_db_stats.set(stats)
+    started = time.perf_counter()
+
+    def observe(status: int):
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        if route_path != "/metrics":
+            REQUEST_LATENCY.labels(request.method, route_path, status).observe(time.perf_counter() - started)
+            DB_QUERIES_PER_REQUEST.labels(route_path).observe(len(stats.durations))
+            for duration in stats.durations:
+                DB_QUERY_DURATION.labels(route_path).observe(duration)
+            if status >= 500:
+                REQUEST_ERRORS.labels(request.method, route_path, status).inc()
 
-@app.put("/employees/{employee_id}", response_model=Employee, summary="更新員工", tags=["員工管理"])
-def update_employee(employee_id: int, employee_update: EmployeeCreate, session: Session = Depends(get_session)):
-    """根據 ID 更新現有員工資料，員工編號若更改必須保持唯一。"""
-    
-    # 1. 檢查員工是否存在
-    old_employee = session.get(Employee, employee_id)
-    if not old_employee:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    
-    # 2. 將更新的資料複製到舊物件上
-    updated_data = employee_update.model_dump()
-    for key, value in updated_data.items():
-        setattr(old_employee, key, value)
-        
     try:
-        session.add(old_employee) 
-        session.commit()
-        session.refresh(old_employee)
-    except IntegrityError:
-        # 捕捉資料庫唯一性錯誤 (員工編號與其他記錄重複)
-        session.rollback()
-        raise HTTPException(status_code=400, detail=f"新員工編號 {employee_update.employee_code} 已被其他員工使用。")
-    except Exception as e:
-        session.rollback()
-        raise HTTPException(status_code=500, detail=f"內部資料儲存錯誤: {e}")
-    
-    return old_employee
+        response = await call_next(request)
+    except Exception:
+        observe(500)
+        raise
 
-# main.py - 調整 DELETE 路由
+    body_iterator = response.body_iterator
 
-@app.delete("/employees/{employee_id}", status_code=204, summary="刪除員工", tags=["員工管理"])
-def delete_employee(employee_id: int, session: Session = Depends(get_session)):
-    """根據 ID 刪除特定員工。"""
-    
-    # 檢查員工是否存在
-    employee_to_delete = session.get(Employee, employee_id)
-    
-    if not employee_to_delete:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    
-    # 執行刪除
-    session.delete(employee_to_delete)
-    session.commit()
-    
-    # 返回 204 No Content
-    return
+    async def observed_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            observe(response.status_code)
 
-# main.py - 調整 POST /upload 批次上傳路由
+    response.body_iterator = observed_body()
+    return response
 
-@app.post("/upload", summary="批次上傳 CSV 格式文件", tags=["批次處理"])
-async def bulk_upload(file: UploadFile = File(...), session: Session = Depends(get_session)):
+# --- 員工資料快取 ---
+
+# 快取存活秒數 (0 表示停用) 與本機快取的最大筆數
+EMPLOYEE_CACHE_TTL = int(os.getenv("EMPLOYEE_CACHE_TTL", "60"))
+EMPLOYEE_CACHE_SIZE = int(os.getenv("EMPLOYEE_CACHE_SIZE", "10000"))
+# 設定後改用 Redis 作為共享快取 (多個 uvicorn worker 共用且同步失效；需另行安裝 redis 套件)
+EMPLOYEE_CACHE_REDIS_URL = os.getenv("EMPLOYEE_CACHE_REDIS_URL")
+
+CACHE_REQUESTS = MetricCounter("hrm_employee_cache_requests_total", "單一員工快取查詢次數", ["result"])
+
+class EmployeeCache(ABC):
     """
-    處理上傳的檔案。使用單一事務處理，若有任一筆員工編號衝突，則整批資料撤銷 (Rollback)。
+    員工資料快取介面：以員工 ID 為鍵，儲存已序列化的 JSON 字串 (ETag 由內容雜湊而得，不另外儲存)。
+    get 同時回傳讀取當下的失效世代；未命中時以該世代呼叫 set，若期間該筆已被失效 (寫入者已提交)，
+    set 不會寫入，避免把查詢到的舊資料放回快取。
     """
-    contents = await file.read()
-    
+
+    @abstractmethod
+    async def get(self, employee_id: int) -> Tuple[Optional[str], Any]:
+        """回傳 (快取內容或 None, 失效世代)。"""
+
+    @abstractmethod
+    async def set(self, employee_id: int, payload: str, generation: Any):
+        """寫入快取；generation 與目前世代不同時略過。"""
+
+    @abstractmethod
+    async def delete(self, employee_id: int):
+        """移除單筆並推進該筆的失效世代。"""
+
+    @abstractmethod
+    async def clear(self):
+        """清空快取並推進全域失效世代。"""
+
+class LocalEmployeeCache(EmployeeCache):
+    """程序內的 LRU + TTL 快取 (每個 uvicorn worker 各自一份)。"""
+
+    def __init__(self, maxsize: int, ttl: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        # 失效世代：全域一個，另記錄最近失效的 ID (數量有上限，淘汰時推進全域世代以保持保守)
+        self._generation = 0
+        self._generations: "OrderedDict[int, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _current_generation(self, employee_id: int) -> tuple:
+        return (self._generation, self._generations.get(employee_id, 0))
+
+    async def get(self, employee_id: int) -> Tuple[Optional[str], Any]:
+        with self._lock:
+            generation = self._current_generation(employee_id)
+            entry = self._entries.get(employee_id)
+            if entry is None:
+                return None, generation
+            expires_at, payload = entry
+            if expires_at < time.monotonic():
+                del self._entries[employee_id]
+                return None, generation
+            self._entries.move_to_end(employee_id)
+            return payload, generation
+
+    async def set(self, employee_id: int, payload: str, generation: Any):
+        with self._lock:
+            if generation != self._current_generation(employee_id):
+                return
+            self._entries[employee_id] = (time.monotonic() + self.ttl, payload)
+            self._entries.move_to_end(employee_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    async def delete(self, employee_id: int):
+        with self._lock:
+            self._entries.pop(employee_id, None)
+            self._generations[employee_id] = self._generations.get(employee_id, 0) + 1
+            self._generations.move_to_end(employee_id)
+            if len(self._generations) > self.maxsize:
+                self._generations.popitem(last=False)
+                self._generation += 1
+
+    async def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._generation += 1
+
+class RedisEmployeeCache(EmployeeCache):
+    """以 Redis 作為共享快取，讓所有 worker 看到相同的失效結果 (使用 redis.asyncio，不阻塞事件迴圈)。"""
+
+    KEY_PREFIX = "hrm:employee:"
+    GENERATION_PREFIX = "hrm:employee-generation:"
+    GLOBAL_GENERATION_KEY = "hrm:employee-generation-all"
+    # 僅在兩個失效世代都與讀取時相同才寫入 (KEYS: 內容、單筆世代、全域世代；ARGV: 內容、兩個世代、TTL)
+    SET_IF_CURRENT = """
+    if (redis.call('GET', KEYS[2]) or '') == ARGV[2] and (redis.call('GET', KEYS[3]) or '') == ARGV[3] then
+        redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[4])
+    end
+    """
+
+    def __init__(self, url: str, ttl: int):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("已設定 EMPLOYEE_CACHE_REDIS_URL，但未安裝 redis 套件 (pip install redis)。")
+        self.ttl = ttl
+        # 單筆世代鍵需比任何一次未命中查詢存活更久，否則過期歸零後舊資料可能被寫回
+        self.generation_ttl = max(ttl * 10, 3600)
+        self._client = redis.Redis.from_url(url)
+        self._set_if_current = self._client.register_script(self.SET_IF_CURRENT)
+
+    async def get(self, employee_id: int) -> Tuple[Optional[str], Any]:
+        payload, generation, global_generation = await self._client.mget(
+            f"{self.KEY_PREFIX}{employee_id}", f"{self.GENERATION_PREFIX}{employee_id}", self.GLOBAL_GENERATION_KEY,
+        )
+        return (payload.decode("utf-8") if payload is not None else None), (generation or b"", global_generation or b"")
+
+    async def set(self, employee_id: int, payload: str, generation: Any):
+        await self._set_if_current(
+            keys=[f"{self.KEY_PREFIX}{employee_id}", f"{self.GENERATION_PREFIX}{employee_id}", self.GLOBAL_GENERATION_KEY],
+            args=[payload, *generation, self.ttl],
+        )
+
+    async def delete(self, employee_id: int):
+        generation_key = f"{self.GENERATION_PREFIX}{employee_id}"
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.incr(generation_key)
+            pipe.expire(generation_key, self.generation_ttl)
+            pipe.delete(f"{self.KEY_PREFIX}{employee_id}")
+            await pipe.execute()
+
+    async def clear(self):
+        await self._client.incr(self.GLOBAL_GENERATION_KEY)
+        keys = [key async for key in self._client.scan_iter(match=f"{self.KEY_PREFIX}*", count=1000)]
+        for start in range(0, len(keys), 1000):
+            await self._client.delete(*keys[start:start + 1000])
+
+def create_employee_cache() -> Optional[EmployeeCache]:
+    """依環境變數建立快取；TTL 為 0 時停用快取。"""
+    if EMPLOYEE_CACHE_TTL <= 0:
+        return None
+    if EMPLOYEE_CACHE_REDIS_URL:
+        return RedisEmployeeCache(EMPLOYEE_CACHE_REDIS_URL, EMPLOYEE_CACHE_TTL)
+    return LocalEmployeeCache(EMPLOYEE_CACHE_SIZE, EMPLOYEE_CACHE_TTL)
+
+employee_cache = create_employee_cache()
+# 應用程式的事件迴圈 (啟動時記錄)，供背景執行緒將快取失效交由事件迴圈執行
+app_loop: Optional[asyncio.AbstractEventLoop] = None
+
+async def invalidate_employee_cache(employee_id: Optional[int] = None):
+    """使快取失效：指定 ID 時僅移除該筆，否則清空 (批次上傳後使用)。"""
+    if employee_cache is None:
+        return
+    if employee_id is None:
+        await employee_cache.clear()
+    else:
+        await employee_cache.delete(employee_id)
+
+def invalidate_employee_cache_from_thread(employee_id: Optional[int] = None):
+    """invalidate_employee_cache 的同步版本，供執行緒池與背景工作執行緒中的批次上傳使用。"""
+    if employee_cache is None:
+        return
+    if app_loop is not None and app_loop.is_running():
+        asyncio.run_coroutine_threadsafe(invalidate_employee_cache(employee_id), app_loop).result()
+    else:
+        # 未在應用程式中執行 (例如直接呼叫上傳流程的腳本)
+        asyncio.run(invalidate_employee_cache(employee_id))
+
+# --- 條件式請求 (ETag) ---
+
+def payload_etag(payload: str) -> str:
+    """由序列化內容計算強 ETag。"""
+    return '"' + hashlib.blake2b(payload.encode("utf-8"), digest_size=12).hexdigest() + '"'
+
+def employee_etag(payload: str) -> str:
+    """
+    單一員工的 ETag：`"v{版本號}-{內容雜湊}"`。
+    版本號供 If-Match 樂觀鎖比對；內容雜湊確保不同資料 (例如 ID 被重複使用) 不會有相同的 ETag。
+    雜湊以排序後的欄位計算，與序列化時的欄位順序無關。
+    """
+    data = json.loads(payload)
+    digest = payload_etag(json.dumps(data, sort_keys=True, ensure_ascii=False)).strip('"')
+    return f'"v{data.get("version", 0)}-{digest}"'
+
+EMPLOYEE_ETAG_PATTERN = re.compile(r'^(?:W/)?"v(\d+)-[0-9a-f]+"$')
+
+def parse_if_match(request: Request) -> Optional[int]:
+    """
+    解析 If-Match 標頭，回傳預期的版本號；未提供或為 `*` 時回傳 None (不檢查版本)。
+    格式不正確時視為前置條件失敗 (412)。
+    """
+    header = request.headers.get("if-match")
+    if header is None or header.strip() == "*":
+        return None
+    match = EMPLOYEE_ETAG_PATTERN.match(header.strip())
+    if not match:
+        raise HTTPException(status_code=412, detail="If-Match 標頭格式不正確，請使用 GET 回應中的 ETag。")
+    return int(match.group(1))
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """判斷 If-None-Match 標頭是否包含目前的 ETag (比較時忽略弱驗證前綴 W/)。"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in (c.removeprefix("W/") for c in candidates)
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+async def read_table_version(session: AsyncSession) -> int:
+    """讀取員工表格目前的版本號 (單列主鍵查詢)。"""
+    version = (await session.exec(select(EmployeeTableVersion.version).where(EmployeeTableVersion.id == 1))).first()
+    return version or 0
+
+# 遞增員工表格版本號；須與資料異動在同一交易中執行 (同步與非同步會話皆可使用)
+BUMP_TABLE_VERSION = (
+    update(EmployeeTableVersion)
+    .where(EmployeeTableVersion.id == 1)
+    .values(version=EmployeeTableVersion.version + 1)
+)
+
+# --- 變更紀錄 ---
+
+EMPLOYEE_CHANGES_PAGE_SIZE = int(os.getenv("EMPLOYEE_CHANGES_PAGE_SIZE", "1000"))
+EMPLOYEE_CHANGE_INSERT = EmployeeChange.__table__.insert()
+
+def change_entries(op: str, employee_ids) -> List[Dict[str, Any]]:
+    """建立變更紀錄列 (同一種操作)。"""
+    return [{"employee_id": employee_id, "op": op} for employee_id in employee_ids]
+
+def upserted_change_entries(rows) -> List[Dict[str, Any]]:
+    """由 upsert 的 RETURNING (id, version) 建立變更紀錄：新列的版本號為 1，其餘為更新。"""
+    return [{"employee_id": employee_id, "op": "insert" if version == 1 else "update"} for employee_id, version in rows]
+
+# 批次上傳期間寫入的員工 (暫存表，每個連線各自一份)：逐批寫入資料庫而非累積於記憶體，提交前才轉存為變更紀錄
+UPLOAD_CHANGES = Table(
+    "employee_upload_changes", MetaData(),
+    Column("employee_id", Integer, nullable=False),
+    Column("op", String, nullable=False),
+)
+
+def create_upload_changes_table(session: Session):
+    """建立批次上傳的變更暫存表 (已存在時略過)；PostgreSQL 於交易結束時自動刪除。"""
+    on_commit = " ON COMMIT DROP" if engine.dialect.name == "postgresql" else ""
+    session.connection().exec_driver_sql(
+        f"CREATE TEMP TABLE IF NOT EXISTS employee_upload_changes (employee_id integer NOT NULL, op varchar NOT NULL){on_commit}"
+    )
+
+def add_upload_changes(session: Session, changes: list):
+    """將一批寫入的員工 (change_entries 格式) 加入變更暫存表。"""
+    if changes:
+        create_upload_changes_table(session)
+        session.execute(UPLOAD_CHANGES.insert(), changes)
+
+def add_upload_changes_returning(session: Session, statement) -> int:
+    """
+    執行 RETURNING (id, version) 的集合式寫入，並將寫入的列加入變更暫存表，回傳寫入筆數。
+    PostgreSQL 以資料異動 CTE 在資料庫內完成；其他資料庫逐批讀取 RETURNING 結果，不一次取回。
+    """
+    create_upload_changes_table(session)
+    if engine.dialect.name == "postgresql":
+        written = statement.cte("written")
+        op = case((written.c.version == 1, "insert"), else_="update")
+        return session.execute(
+            UPLOAD_CHANGES.insert().from_select(["employee_id", "op"], select(written.c.id, op))
+        ).rowcount
+    count = 0
+    for rows in session.execute(statement).partitions(UPLOAD_INSERT_CHUNK_SIZE):
+        session.execute(UPLOAD_CHANGES.insert(), upserted_change_entries(rows))
+        count += len(rows)
+    return count
+
+def record_employee_write(session: Session):
+    """
+    批次上傳於提交前呼叫：遞增表格版本號，再以 INSERT ... SELECT 將變更暫存表轉存為變更紀錄。
+    版本號列的更新會持有列鎖直到提交，之後才取得的 seq 因此與提交順序一致，
+    用戶端以 since 讀取時不會因較早的序號較晚提交而漏掉變更。
+    """
+    session.execute(BUMP_TABLE_VERSION)
+    create_upload_changes_table(session)
+    session.execute(EmployeeChange.__table__.insert().from_select(
+        ["employee_id", "op"], select(UPLOAD_CHANGES.c.employee_id, UPLOAD_CHANGES.c.op)
+    ))
+    # SQLite 的暫存表在連線存續期間保留，清空供下一次交易使用
+    session.execute(delete(UPLOAD_CHANGES))
+
+async def record_employee_write_async(session: AsyncSession, changes: list) -> List[int]:
+    """遞增表格版本號並寫入 changes (AsyncSession，單筆與批次 API 使用)，回傳各變更的序號 (供即時推播使用)。"""
+    await session.exec(BUMP_TABLE_VERSION)
+    if not changes:
+        return []
+    statement = EMPLOYEE_CHANGE_INSERT.returning(EmployeeChange.__table__.c.seq, sort_by_parameter_order=True)
+    return list((await session.exec(statement, params=changes)).scalars())
+
+# --- 即時推播 (SSE) ---
+
+# 每個連線最多暫存的事件數；超過代表用戶端跟不上，改送 sync 事件
+EMPLOYEE_EVENTS_QUEUE_SIZE = int(os.getenv("EMPLOYEE_EVENTS_QUEUE_SIZE", "100"))
+EMPLOYEE_EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EMPLOYEE_EVENTS_MAX_SUBSCRIBERS", "200"))
+# 單一事件最多攜帶的變更數；更大的異動 (批次上傳、依條件刪除) 只通知用戶端自行同步
+EMPLOYEE_EVENTS_MAX_CHANGES = int(os.getenv("EMPLOYEE_EVENTS_MAX_CHANGES", "500"))
+# 閒置時送出註解行，避免代理伺服器關閉連線
+EMPLOYEE_EVENTS_KEEPALIVE = float(os.getenv("EMPLOYEE_EVENTS_KEEPALIVE", "15"))
+
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+# 通知用戶端透過 GET /employees/changes 補齊變更
+SYNC_EVENT = format_sse("sync", {})
+
+class EmployeeEventBroadcaster:
+    """
+    將員工變更廣播給目前程序中的所有 SSE 連線。
+    每個連線有固定大小的佇列；佇列已滿時清空積壓事件並改放一個 sync 事件，
+    由用戶端以變更紀錄補齊。發佈端永遠不會因慢速連線而阻塞，記憶體用量也有上限。
+    """
+
+    def __init__(self, queue_size: int = EMPLOYEE_EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers: set = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self) -> asyncio.Queue:
+        if len(self.subscribers) >= EMPLOYEE_EVENTS_MAX_SUBSCRIBERS:
+            raise HTTPException(status_code=503, detail="即時推播連線數已達上限，請稍後再試。")
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, message: str):
+        """發佈已格式化的 SSE 訊息；可由事件迴圈或背景執行緒 (批次上傳) 呼叫。"""
+        if not self.subscribers or self.loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._deliver(message)
+        else:
+            try:
+                self.loop.call_soon_threadsafe(self._deliver, message)
+            except RuntimeError:
+                # 事件迴圈已關閉 (應用程式結束中)
+                pass
+
+    def _deliver(self, message: str):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(SYNC_EVENT)
+
+employee_events = EmployeeEventBroadcaster()
+
+def publish_employee_changes(changes: list, seqs: List[int], employees: Dict[int, "Employee"]):
+    """於提交後推播變更 (含序號與員工目前資料)；變更過多時改送 sync 事件。"""
+    if len(changes) > EMPLOYEE_EVENTS_MAX_CHANGES:
+        employee_events.publish(SYNC_EVENT)
+        return
+    payload = [
+        {
+            "seq": seq,
+            "op": change["op"],
+            "employee_id": change["employee_id"],
+            "employee": None if change["op"] == "delete" or change["employee_id"] not in employees
+            else employees[change["employee_id"]].model_dump(),
+        }
+        for change, seq in zip(changes, seqs)
+    ]
+    employee_events.publish(format_sse("change", {"changes": payload}))
+
+# 【新增】分頁設定 (可透過環境變數調整)
+# 預設每頁筆數與每頁筆數上限，避免單一請求回傳整張表格
+EMPLOYEES_PAGE_SIZE = int(os.getenv("EMPLOYEES_PAGE_SIZE", "50"))
+EMPLOYEES_PAGE_SIZE_MAX = int(os.getenv("EMPLOYEES_PAGE_SIZE_MAX", "500"))
+# 串流匯出時每批從資料庫讀取的筆數 (記憶體用量與此值成正比)
+EMPLOYEES_STREAM_BATCH_SIZE = int(os.getenv("EMPLOYEES_STREAM_BATCH_SIZE", "1000"))
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# 欄位導向 JSON：{"columns": {"id": [...], "name": [...], ...}, "next_cursor": ...}，每個欄位名稱只出現一次
+COLUMNAR_MEDIA_TYPE = "application/vnd.hrm.columns+json"
+# POST /employees:batch 單次請求的操作數上限
+EMPLOYEES_BATCH_MAX = int(os.getenv("EMPLOYEES_BATCH_MAX", "1000"))
+# 快速序列化模式 (選用)：清單查詢只選取欄位 tuple，並以 orjson 直接編碼，略過 ORM 物件與 response_model 驗證
+EMPLOYEES_FAST_JSON = os.getenv("EMPLOYEES_FAST_JSON", "false").lower() in ("1", "true", "yes")
+EMPLOYEE_COLUMNS = tuple(Employee.__table__.c)
+
+class OrjsonResponse(Response):
+    """以 orjson 編碼內容的 JSON 回應 (內容須為 dict / list 等基本型別)。"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+# 允許排序的欄位；以 "-" 前綴表示遞減 (例如 sort=-salary)
+EMPLOYEE_SORT_FIELDS = {
+    "id": Employee.id,
+    "employee_code": Employee.employee_code,
+    "name": Employee.name,
+    "position": Employee.position,
+    "department": Employee.department,
+    "salary": Employee.salary,
+}
+
+def encode_cursor(data: Dict) -> str:
+    """將分頁位置編碼為不透明的游標字串 (URL-safe base64)。"""
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Dict:
+    """解析游標字串；格式不正確時回傳 400。"""
     try:
-        decoded_content = contents.decode('utf-8')
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="檔案編碼錯誤，請確保使用 UTF-8 編碼。")
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise HTTPException(status_code=400, detail="無效的分頁游標。")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="無效的分頁游標。")
+    return data
 
-    csv_reader = csv.reader(StringIO(decoded_content))
-    
+def build_employee_filters(
+    department: Optional[str] = None,
+    position: Optional[str] = None,
+    salary_min: Optional[int] = None,
+    salary_max: Optional[int] = None,
+    q: Optional[str] = None,
+) -> list:
+    """將查詢參數轉換為 SQL 條件 (皆可使用索引：等值、範圍與前綴比對)。"""
+    conditions = []
+    if department:
+        conditions.append(Employee.department == department)
+    if position:
+        conditions.append(Employee.position == position)
+    if salary_min is not None:
+        conditions.append(Employee.salary >= salary_min)
+    if salary_max is not None:
+        conditions.append(Employee.salary <= salary_max)
+    if q:
+        # 前綴比對 (LIKE 'q%')；樣式需以完整參數傳入 (而非 `? || '%'`)，資料庫才能使用索引
+        pattern = q.replace("/", "//").replace("%", "/%").replace("_", "/_") + "%"
+        # 不分大小寫：SQLite 的 LIKE 本身即不分大小寫 (並可使用 NOCASE 索引)；
+        # PostgreSQL 的 LIKE 區分大小寫，改用 ILIKE (trigram 索引同樣支援)
+        if engine.dialect.name == "postgresql":
+            conditions.append(or_(
+                Employee.name.ilike(pattern, escape="/"),
+                Employee.employee_code.ilike(pattern, escape="/"),
+            ))
+        else:
+            conditions.append(or_(
+                Employee.name.like(pattern, escape="/"),
+                Employee.employee_code.like(pattern, escape="/"),
+            ))
+    return conditions
+
+def parse_sort(sort: str):
+    """解析排序參數，回傳 (欄位名稱, 欄位, 是否遞減)。"""
+    descending = sort.startswith("-")
+    field_name = sort.lstrip("-")
+    if field_name not in EMPLOYEE_SORT_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支援的排序欄位: '{field_name}'，可用欄位：{', '.join(EMPLOYEE_SORT_FIELDS)}。",
+        )
+    return field_name, EMPLOYEE_SORT_FIELDS[field_name], descending
+
+def stream_employees_ndjson(conditions: Optional[list] = None, sort: str = "id"):
+    """
+    以 NDJSON (每行一筆 JSON) 逐批輸出員工表格 (可套用篩選條件與排序)。
+    使用 yield_per 讓資料庫游標分批取回資料，不會一次載入所有列。
+    """
+    _, sort_column, descending = parse_sort(sort)
+    if descending:
+        order_by = (sort_column.desc(), Employee.id.desc())
+    else:
+        order_by = (sort_column, Employee.id)
+    # 串流在回應送出期間才執行，因此自行開啟會話而不依賴 get_session
+    with Session(engine) as session:
+        statement = select(Employee).where(*(conditions or [])).order_by(*order_by)
+        statement = statement.execution_options(yield_per=EMPLOYEES_STREAM_BATCH_SIZE)
+        for batch in session.exec(statement).partitions():
+            chunk = "".join(
+                json.dumps(employee.model_dump(), ensure_ascii=False) + "\n" for employee in batch
+            )
+            # 已輸出的物件不再保留於 identity map 中 (逐一移出；expunge_all 會使 yield_per 仍在使用的 identity map 失效)
+            for employee in batch:
+                session.expunge(employee)
+            ROWS_RETURNED.labels("/employees").inc(len(batch))
+            yield chunk.encode("utf-8")
+
+# PostgreSQL 的 trigram 索引需要 pg_trgm 擴充套件，於建立表格前先行啟用
+event.listen(
+    SQLModel.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+def create_db_and_tables():
+    """使用 SQLModel 創建資料庫中的所有表格與索引。"""
+    SQLModel.metadata.create_all(engine)
+    # create_all 不會替已存在的表格補建新欄位，舊版資料庫需補上 version 欄位
+    if "version" not in {column["name"] for column in inspect(engine).get_columns("employee")}:
+        with engine.begin() as connection:
+            connection.exec_driver_sql("ALTER TABLE employee ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+    upload_job_columns = {column["name"] for column in inspect(engine).get_columns("upload_job")}
+    for name in ("owner", "heartbeat_at"):
+        if name not in upload_job_columns:
+            column_type = UploadJob.__table__.c[name].type.compile(dialect=engine.dialect)
+            with engine.begin() as connection:
+                connection.exec_driver_sql(f"ALTER TABLE upload_job ADD COLUMN {name} {column_type}")
+    # create_all 不會替已存在的表格補建新索引，因此逐一檢查並建立
+    with engine.begin() as connection:
+        for index in Employee.__table__.indexes:
+            index.create(connection, checkfirst=True)
+    # 建立表格版本計數器的唯一一列 (多個 worker 同時啟動時可能重複插入，忽略即可)
     try:
-        header = next(csv_reader) # 假設第一行是標頭
-    except StopIteration:
-        raise HTTPException(status_code=400, detail="檔案內容為空。")
+        with engine.begin() as connection:
+            if connection.execute(select(EmployeeTableVersion.id)).first() is None:
+                connection.execute(EmployeeTableVersion.__table__.insert().values(id=1, version=0))
+    except IntegrityError:
+        pass
 
-    expected_columns = 5 
-    if len(header) < expected_columns:
-        raise HTTPException(status_code=400, detail="檔案標頭不完整，預期欄位：姓名 (Name), 員工編號 (Code), 職位 (Position), 部門 (Department), 薪資 (Salary)。")
+def get_session():
+    """依賴注入函式：管理資料庫會話的生命週期 (同步，供批次上傳使用)。"""
+    with Session(engine) as session:
+        yield session
 
-    success_count = 0
-    error_entries = []
-    
+async def get_async_session():
+    """依賴注入函式：管理非同步資料庫會話的生命週期 (員工 CRUD 路由使用)。"""
+    async with async_session_factory() as session:
+        yield session
+
+# --- 批次上傳工具 ---
+
+# CSV 必要欄位數 (姓名, 員工編號, 職位, 部門, 薪資)
+UPLOAD_EXPECTED_COLUMNS = 5
+# 非 PostgreSQL 時，每個多列 INSERT 語句包含的筆數
+UPLOAD_INSERT_CHUNK_SIZE = int(os.getenv("UPLOAD_INSERT_CHUNK_SIZE", "1000"))
+# 寫入 employee 表格的欄位 (id 由資料庫產生)
+EMPLOYEE_DATA_COLUMNS = ["employee_code", "name", "position", "department", "salary"]
+
+def validate_upload_rows(csv_reader, error_entries: list):
+    """
+    逐列驗證 CSV 資料 (標頭之後)，產生 (列號, 可直接寫入資料庫的 dict)。
+    驗證失敗的列會附加到 error_entries，不會中斷處理。
+    """
     # 建立一個暫時集合來檢查當前批次中的重複編號
     current_batch_codes = set()
 
@@ -217,13 +1133,13 @@ async def bulk_upload(file: UploadFile = File(...), session: Session = Depends(g
         row_num_display = row_number + 2 
         
         # 1. 檢查欄位數量
-        if len(row) < expected_columns:
+        if len(row) < UPLOAD_EXPECTED_COLUMNS:
             error_entries.append({"row": row_num_display, "error": "資料欄位不足", "data": row})
             continue
         
         # 2. 欄位擷取與清理
         try:
-            name, code, position, department, salary_str = [field.strip() for field in row[:expected_columns]]
+            name, code, position, department, salary_str = [field.strip() for field in row[:UPLOAD_EXPECTED_COLUMNS]]
         except Exception as e:
             error_entries.append({"row": row_num_display, "error": f"資料擷取或格式化錯誤: {e}", "data": row})
             continue
@@ -246,9 +1162,8 @@ async def bulk_upload(file: UploadFile = File(...), session: Session = Depends(g
         if code in current_batch_codes:
             error_entries.append({"row": row_num_display, "error": f"員工編號 '{code}' 在本次上傳中重複。", "data": row})
             continue
-        current_batch_codes.add(code)
-            
-        # 6. 成功新增資料 (暫時加入 session)
+
+        # 6. 模型驗證，成功則交由呼叫端寫入
         try:
             employee_data = EmployeeCreate(
                 name=name,
@@ -259,30 +1174,1119 @@ async def bulk_upload(file: UploadFile = File(...), session: Session = Depends(g
             )
             
             new_employee = Employee.model_validate(employee_data)
-            
-            session.add(new_employee)
-            success_count += 1
-            
         except Exception as e:
             error_entries.append({"row": row_num_display, "error": f"資料驗證錯誤: {e}", "data": row})
-            if code in current_batch_codes:
-                 current_batch_codes.remove(code)
+            continue
+
+        current_batch_codes.add(code)
+        yield row_num_display, new_employee.model_dump(include=set(EMPLOYEE_DATA_COLUMNS))
+
+def iter_chunks(rows, size: int):
+    """將可迭代物件切分為每組 size 筆的 list。"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def conflict_error(row_num: int, data: dict) -> dict:
+    """建立「員工編號已存在於資料庫」的錯誤項目 (data 依 CSV 欄位順序呈現)。"""
+    return {
+        "row": row_num,
+        "error": f"員工編號 '{data['employee_code']}' 已存在於資料庫中。",
+        "data": [data["name"], data["employee_code"], data["position"], data["department"], str(data["salary"])],
+    }
+
+class _CopyRowsReader:
+    """將 (列號, 資料) 轉換為 COPY ... FORMAT csv 所需的唯讀檔案介面，依需求逐列產生。"""
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._buffer = StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator="\n")
+        self._pending = ""
+        self.count = 0
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self._pending) < size:
+            item = next(self._rows, None)
+            if item is None:
+                break
+            row_num, row = item
+            self._writer.writerow([row_num] + [row[column] for column in EMPLOYEE_DATA_COLUMNS])
+            self._pending += self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+            self.count += 1
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    readline = read
+
+def _copy_employees_postgresql(session: Session, rows, error_entries: list) -> int:
+    """
+    PostgreSQL：以 COPY FROM STDIN 串流寫入暫存表，再以單一 INSERT ... ON CONFLICT DO NOTHING 合併至 employee。
+    RETURNING 取得實際寫入的編號，其餘即為與既有資料衝突的列；寫入的 ID 於同一語句中存入變更暫存表。
+    """
+    connection = session.connection()
+    columns = ", ".join(EMPLOYEE_DATA_COLUMNS)
+    connection.exec_driver_sql(
+        "CREATE TEMP TABLE IF NOT EXISTS employee_import "
+        "(row_num integer, employee_code text, name text, position text, department text, salary integer) "
+        "ON COMMIT DROP"
+    )
+    create_upload_changes_table(session)
+    reader = _CopyRowsReader(rows)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY employee_import (row_num, {columns}) FROM STDIN WITH (FORMAT csv)", reader)
+    finally:
+        cursor.close()
+
+    conflicts = connection.exec_driver_sql(
+        f"WITH inserted AS ("
+        f"  INSERT INTO employee ({columns}) SELECT {columns} FROM employee_import ORDER BY row_num"
+        f"  ON CONFLICT (employee_code) DO NOTHING RETURNING id, employee_code"
+        f"), saved AS ("
+        f"  INSERT INTO employee_upload_changes (employee_id, op) SELECT id, 'insert' FROM inserted"
+        f") "
+        f"SELECT row_num, {columns} FROM employee_import "
+        f"WHERE employee_code NOT IN (SELECT employee_code FROM inserted) ORDER BY row_num"
+    ).mappings().all()
+    for conflict in conflicts:
+        error_entries.append(conflict_error(conflict["row_num"], conflict))
+    return reader.count - len(conflicts)
+
+def insert_employees_bulk(session: Session, rows, error_entries: list) -> int:
+    """
+    批次寫入員工資料 (不提交)，回傳寫入筆數。rows 為 (列號, 資料) 的可迭代物件。
+    員工編號已存在於資料庫的列不會寫入，並逐列記錄於 error_entries；寫入的列加入變更暫存表。
+    PostgreSQL + psycopg2 使用 COPY；其他情況以每組 UPLOAD_INSERT_CHUNK_SIZE 筆的多列 INSERT 寫入，
+    寫入前以 `WHERE employee_code IN (...)` 檢查該組編號是否已存在。
+    """
+    if engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2":
+        return _copy_employees_postgresql(session, rows, error_entries)
+
+    count = 0
+    for chunk in iter_chunks(rows, UPLOAD_INSERT_CHUNK_SIZE):
+        codes = [data["employee_code"] for _, data in chunk]
+        existing = set(session.exec(select(Employee.employee_code).where(Employee.employee_code.in_(codes))).all())
+        to_insert = []
+        for row_num, data in chunk:
+            if data["employee_code"] in existing:
+                error_entries.append(conflict_error(row_num, data))
+            else:
+                to_insert.append(data)
+        if to_insert:
+            statement = Employee.__table__.insert().returning(Employee.__table__.c.id)
+            add_upload_changes(session, change_entries("insert", session.execute(statement, to_insert).scalars()))
+            count += len(to_insert)
+    return count
+
+def employee_upsert_statement(source=None):
+    """
+    建立以 employee_code 為鍵的 `INSERT ... ON CONFLICT DO UPDATE` 敘述：僅在有欄位變更時改寫該列並遞增版本號。
+    source 為 select 時以 INSERT ... SELECT 寫入 (欄位依 EMPLOYEE_DATA_COLUMNS 順序)；未提供時於執行時傳入參數。
+    """
+    if engine.dialect.name == "postgresql":
+        dialect_insert = postgresql.insert
+    elif engine.dialect.name == "sqlite":
+        dialect_insert = sqlite.insert
+    else:
+        raise HTTPException(status_code=400, detail=f"目前的資料庫 ({engine.dialect.name}) 不支援 upsert 模式。")
+
+    table = Employee.__table__
+    statement = dialect_insert(table)
+    if source is not None:
+        statement = statement.from_select(EMPLOYEE_DATA_COLUMNS, source)
+    update_columns = [column for column in EMPLOYEE_DATA_COLUMNS if column != "employee_code"]
+    return statement.on_conflict_do_update(
+        index_elements=[table.c.employee_code],
+        set_={**{column: statement.excluded[column] for column in update_columns}, "version": table.c.version + 1},
+        where=or_(*(table.c[column] != statement.excluded[column] for column in update_columns)),
+    )
+
+def upsert_employees_bulk(session: Session, rows) -> Dict[str, int]:
+    """
+    以 employee_code 為鍵批次 upsert (不提交)，回傳 inserted / updated / unchanged 筆數；新增與更新的列加入變更暫存表。
+    每組 UPLOAD_INSERT_CHUNK_SIZE 筆執行一次 `INSERT ... ON CONFLICT DO UPDATE ... WHERE 有欄位變更`，
+    內容未變更的列不會被改寫。PostgreSQL 與 SQLite 皆支援此語法。
+    """
+    table = Employee.__table__
+    statement = employee_upsert_statement().returning(table.c.employee_code, table.c.id, table.c.version)
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    for chunk in iter_chunks(rows, UPLOAD_INSERT_CHUNK_SIZE):
+        codes = [data["employee_code"] for _, data in chunk]
+        # 先取得已存在的編號，用以區分 RETURNING 回傳的列是新增或更新
+        existing = set(session.exec(select(Employee.employee_code).where(Employee.employee_code.in_(codes))).all())
+        returned = session.execute(statement, [data for _, data in chunk]).all()
+        add_upload_changes(session, upserted_change_entries((employee_id, version) for _, employee_id, version in returned))
+        written = {code for code, _, _ in returned}
+        for code in codes:
+            if code not in existing:
+                counts["inserted"] += 1
+            elif code in written:
+                counts["updated"] += 1
+            else:
+                counts["unchanged"] += 1
+    return counts
+
+def stage_employees(session: Session, import_id: str, rows) -> int:
+    """將 (列號, 資料) 寫入暫存表 (不提交)，回傳寫入筆數。"""
+    data = [{"import_id": import_id, "row_num": row_num, **row} for row_num, row in rows]
+    if data:
+        session.execute(EmployeeUploadStaging.__table__.insert(), data)
+    return len(data)
+
+def merge_staged_employees(session: Session, import_id: str, mode: str, error_entries: list) -> Dict[str, int]:
+    """
+    以集合式 SQL 將暫存表中的一次上傳合併至 employee (不提交)，並清除暫存資料。
+    insert 模式回報與既有編號衝突的列；upsert 模式回傳 inserted / updated / unchanged 筆數。
+    實際寫入的列加入變更暫存表。
+    """
+    staging = EmployeeUploadStaging.__table__
+    table = Employee.__table__
+    columns = [staging.c[column] for column in EMPLOYEE_DATA_COLUMNS]
+    in_batch = staging.c.import_id == import_id
+    code_exists = exists().where(table.c.employee_code == staging.c.employee_code)
+
+    total = session.execute(select(func.count()).select_from(staging).where(in_batch)).scalar_one()
+    new_count = session.execute(select(func.count()).select_from(staging).where(in_batch, ~code_exists)).scalar_one()
+
+    if mode == "upsert":
+        statement = employee_upsert_statement(
+            select(*columns).where(in_batch).order_by(staging.c.row_num)
+        ).returning(table.c.id, table.c.version)
+        # RETURNING 同時包含新增與實際更新的列
+        written = add_upload_changes_returning(session, statement)
+        counts = {"inserted": new_count, "updated": written - new_count, "unchanged": total - written}
+    else:
+        conflicts = session.execute(
+            select(staging.c.row_num, *columns).where(in_batch, code_exists).order_by(staging.c.row_num)
+        ).mappings().all()
+        for conflict in conflicts:
+            error_entries.append(conflict_error(conflict["row_num"], conflict))
+        add_upload_changes_returning(session, table.insert().from_select(
+            EMPLOYEE_DATA_COLUMNS, select(*columns).where(in_batch, ~code_exists).order_by(staging.c.row_num)
+        ).returning(table.c.id, table.c.version))
+        counts = {"inserted": new_count}
+
+    session.execute(delete(staging).where(in_batch))
+    return counts
+
+def discard_staged_employees(import_id: str):
+    """上傳失敗時清除暫存表中該次上傳的資料 (使用獨立會話)。"""
+    with Session(engine) as session:
+        session.execute(delete(EmployeeUploadStaging).where(EmployeeUploadStaging.import_id == import_id))
+        session.commit()
+
+# --- 背景匯入工作 ---
+
+# 背景匯入的工作執行緒數量與保留的已完成工作數
+UPLOAD_JOB_WORKERS = int(os.getenv("UPLOAD_JOB_WORKERS", "2"))
+UPLOAD_JOB_HISTORY = int(os.getenv("UPLOAD_JOB_HISTORY", "100"))
+# 處理中的工作寫回進度的最短間隔 (秒)
+UPLOAD_JOB_FLUSH_INTERVAL = float(os.getenv("UPLOAD_JOB_FLUSH_INTERVAL", "1.0"))
+# 上傳檔案暫存目錄 (預設為系統暫存目錄)
+UPLOAD_JOB_DIR = os.getenv("UPLOAD_JOB_DIR", tempfile.gettempdir())
+# 負責程序寫入心跳的間隔，以及超過多久未回報即視為程序已中止 (秒)
+UPLOAD_JOB_HEARTBEAT_INTERVAL = float(os.getenv("UPLOAD_JOB_HEARTBEAT_INTERVAL", "30"))
+UPLOAD_JOB_STALE_SECONDS = float(os.getenv("UPLOAD_JOB_STALE_SECONDS", "300"))
+# 本程序的識別 (同一 PID 重新啟動時以隨機碼區分)
+UPLOAD_JOB_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+upload_job_executor = ThreadPoolExecutor(max_workers=UPLOAD_JOB_WORKERS, thread_name_prefix="upload-job")
+# 本程序負責的工作 (排隊中與處理中)：查詢時優先回傳記憶體中的最新進度
+running_upload_jobs: Dict[str, UploadJob] = {}
+upload_job_heartbeat_task: Optional[asyncio.Task] = None
+
+def register_upload_job(job: UploadJob):
+    """登記新工作，並移除超過保留數量的最舊已完成工作。"""
+    table = UploadJob.__table__
+    finished = table.c.status.in_(("completed", "failed"))
+    kept = select(table.c.id).where(finished).order_by(table.c.created_at.desc()).limit(UPLOAD_JOB_HISTORY)
+    with engine.begin() as connection:
+        connection.execute(table.insert().values(**job.model_dump()))
+        connection.execute(delete(table).where(finished, table.c.id.not_in(kept.scalar_subquery())))
+
+def save_upload_job(job: UploadJob):
+    """將背景執行緒中的工作狀態寫回資料庫 (job 本身不加入任何會話)，同時更新心跳時間。"""
+    table = UploadJob.__table__
+    job.heartbeat_at = datetime.now(timezone.utc)
+    with engine.begin() as connection:
+        connection.execute(update(table).where(table.c.id == job.id).values(**job.model_dump(exclude={"id"})))
+
+def touch_upload_jobs():
+    """為本程序負責且尚未結束的工作寫入心跳時間。"""
+    if not running_upload_jobs:
+        return
+    table = UploadJob.__table__
+    with engine.begin() as connection:
+        connection.execute(
+            update(table)
+            .where(table.c.id.in_(list(running_upload_jobs)), table.c.owner == UPLOAD_JOB_OWNER, table.c.status.in_(("pending", "running")))
+            .values(heartbeat_at=datetime.now(timezone.utc))
+        )
+
+async def upload_job_heartbeat():
+    """定期寫入心跳 (SQLite 匯入期間資料庫被鎖定無法寫入，不啟用；改以程序是否存活判斷)。"""
+    while True:
+        await asyncio.sleep(UPLOAD_JOB_HEARTBEAT_INTERVAL)
+        try:
+            await run_in_threadpool(touch_upload_jobs)
+        except Exception as e:
+            print(f"寫入背景匯入工作心跳失敗: {e}")
+
+def upload_job_owner_alive(owner: Optional[str]) -> Optional[bool]:
+    """判斷負責工作的程序是否仍存活；非本機程序或無法判斷時返回 None。"""
+    if not owner or owner.count(":") < 2 or os.name == "nt": # Windows 的 os.kill 會終止程序，無法用於檢查
+        return None
+    host, pid, _ = owner.rsplit(":", 2)
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def upload_job_is_stale(job: UploadJob) -> bool:
+    """排隊中或處理中的工作，其負責程序已中止 (或超過 UPLOAD_JOB_STALE_SECONDS 未回報心跳) 時視為殘留。"""
+    if job.status not in ("pending", "running") or job.id in running_upload_jobs:
+        return False
+    if job.owner == UPLOAD_JOB_OWNER: # 本程序已不再處理此工作 (例如結束時寫回失敗)
+        return True
+    alive = upload_job_owner_alive(job.owner)
+    if alive is not None and (not alive or engine.dialect.name == "sqlite"):
+        return not alive
+    last_beat = job.heartbeat_at or job.started_at or job.created_at
+    if last_beat.tzinfo is None: # SQLite 讀回的時間不含時區
+        last_beat = last_beat.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - last_beat > timedelta(seconds=UPLOAD_JOB_STALE_SECONDS)
+
+def fail_stale_upload_jobs(session: Session, jobs: List[UploadJob]):
+    """將殘留的工作標記為失敗 (條件式更新：負責程序若仍在寫回，以其結果為準)。"""
+    table = UploadJob.__table__
+    for job in jobs:
+        if not upload_job_is_stale(job):
+            continue
+        result = session.execute(
+            update(table)
+            .where(table.c.id == job.id, table.c.status == job.status, table.c.heartbeat_at.is_not_distinct_from(job.heartbeat_at))
+            .values(status="failed", message="負責此工作的程序已中止，匯入未完成", finished_at=datetime.now(timezone.utc))
+        )
+        session.commit()
+        if result.rowcount:
+            session.refresh(job)
+
+def fail_stale_upload_jobs_on_startup():
+    """啟動時清理先前程序中止後殘留的排隊中 / 處理中工作。"""
+    with Session(engine) as session:
+        jobs = session.exec(select(UploadJob).where(UploadJob.status.in_(("pending", "running")))).all()
+        fail_stale_upload_jobs(session, list(jobs))
+
+def track_upload_progress(csv_reader, job: UploadJob, binary_file, started: float):
+    """包裝 csv.reader，逐列更新工作的處理列數、已讀取位元組與吞吐量，並定期寫回資料庫。"""
+    flushed = started
+    for row in csv_reader:
+        job.rows_processed += 1
+        if job.rows_processed % 1000 == 0:
+            now = time.perf_counter()
+            job.bytes_processed = binary_file.tell()
+            job.rows_per_second = round(job.rows_processed / max(now - started, 1e-6), 1)
+            # SQLite 同時只允許一個寫入交易，匯入進行中無法另行寫入進度，僅於開始與結束時寫回
+            if engine.dialect.name != "sqlite" and now - flushed >= UPLOAD_JOB_FLUSH_INTERVAL:
+                save_upload_job(job)
+                flushed = now
+        yield row
+
+def run_upload_job(job: UploadJob, path: str):
+    """於背景執行緒中處理暫存的上傳檔案，使用獨立的資料庫會話。"""
+    job.status = "running"
+    job.started_at = datetime.now(timezone.utc)
+    started = time.perf_counter()
+    running_upload_jobs[job.id] = job
+    try:
+        save_upload_job(job)
+        with open(path, "rb") as binary_file, Session(engine) as session:
+            text_stream = TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+            csv_reader = track_upload_progress(csv.reader(text_stream), job, binary_file, started)
+            result = process_upload_stream(csv_reader, session, job.mode, job.errors, job.batch_size, job.atomic)
+        for key in ("message", "successful_uploads", "inserted", "updated", "unchanged"):
+            setattr(job, key, result.get(key))
+        job.errors = result["errors"]
+        job.status = "completed"
+    except HTTPException as e:
+        job.message = e.detail
+        job.status = "failed"
+    except Exception as e:
+        job.message = f"背景匯入發生錯誤: {e}"
+        job.status = "failed"
+    finally:
+        elapsed = time.perf_counter() - started
+        job.bytes_processed = job.bytes_total if job.status == "completed" else job.bytes_processed
+        job.rows_per_second = round(job.rows_processed / max(elapsed, 1e-6), 1)
+        job.finished_at = datetime.now(timezone.utc)
+        os.remove(path)
+        try:
+            save_upload_job(job)
+        finally:
+            running_upload_jobs.pop(job.id, None)
+
+@app.on_event("startup")
+async def on_startup():
+    """應用程式啟動時，自動建立資料庫表格 (如果不存在)，清理殘留的背景匯入工作，並記錄事件迴圈供背景執行緒使用。"""
+    global app_loop, upload_job_heartbeat_task
+    app_loop = asyncio.get_running_loop()
+    await run_in_threadpool(create_db_and_tables)
+    await run_in_threadpool(fail_stale_upload_jobs_on_startup)
+    if engine.dialect.name != "sqlite":
+        upload_job_heartbeat_task = asyncio.create_task(upload_job_heartbeat())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """應用程式關閉時，等待進行中的背景匯入工作完成 (於執行緒中等待，不阻塞事件迴圈)，停止心跳並釋放非同步連線池。"""
+    await run_in_threadpool(upload_job_executor.shutdown, wait=True)
+    if upload_job_heartbeat_task is not None:
+        upload_job_heartbeat_task.cancel()
+    await async_engine.dispose()
+
+# --- 3. API 路由 (Routes) ---
+# main.py - 調整 GET 路由
+
+@app.get("/", summary="健康檢查", tags=["系統"])
+def read_root():
+    """系統健康檢查點。"""
+    return {"message": "HRM API 運作中"}
+
+@app.get("/metrics", summary="Prometheus 監控指標", tags=["系統"])
+def read_metrics():
+    """以 Prometheus 文字格式輸出請求延遲、SQL 統計、上傳吞吐量與連線池狀態。"""
+    for name, target_engine in (("sync", engine), ("async", async_engine.sync_engine)):
+        status = pool_status(target_engine, pool_wait_stats[name])
+        for state in ("size", "checked_in", "checked_out", "overflow"):
+            if state in status:
+                POOL_GAUGE.labels(name, state).set(status[state])
+        POOL_WAIT_SECONDS.labels(name).set(status["checkout_wait"]["total_seconds"])
+        POOL_WAIT_MAX.labels(name).set(status["checkout_wait"]["max_seconds"])
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/system/pool", summary="資料庫連線池狀態", tags=["系統"])
+def read_pool_status():
+    """返回同步與非同步連線池的使用量與等待時間，用於依 uvicorn worker 數量調整連線池大小。"""
+    return {
+        "sync": pool_status(engine, pool_wait_stats["sync"]),
+        "async": pool_status(async_engine.sync_engine, pool_wait_stats["async"]),
+    }
+
+@app.get("/employees", response_model=EmployeePage, summary="獲取員工清單 (分頁、篩選、排序)", tags=["員工管理"])
+# 透過 Depends(get_session) 注入資料庫會話
+async def get_employees(
+    request: Request,
+    response: Response,
+    limit: int = Query(EMPLOYEES_PAGE_SIZE, ge=1, description="每頁筆數 (超過上限時自動截斷)"),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 next_cursor"),
+    department: Optional[str] = Query(None, description="部門 (完全相符)"),
+    position: Optional[str] = Query(None, description="職位 (完全相符)"),
+    salary_min: Optional[int] = Query(None, ge=0, description="最低薪資 (含)"),
+    salary_max: Optional[int] = Query(None, ge=0, description="最高薪資 (含)"),
+    q: Optional[str] = Query(None, description="姓名或員工編號的前綴搜尋"),
+    sort: str = Query("id", description="排序欄位，前綴 '-' 表示遞減，例如 -salary"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    以 Keyset (Seek) 分頁返回員工清單，篩選與排序皆在資料庫端執行。
+    使用 `(排序欄位, id) > 上一頁最後一筆` 取代 OFFSET，查詢成本不隨頁數增加。
+
+    若請求標頭 `Accept: application/x-ndjson`，則改為依 sort 排序串流匯出所有符合條件的員工 (忽略分頁參數)。
+    設定 `EMPLOYEES_FAST_JSON=1` 時改走快速序列化路徑 (欄位 tuple + orjson)，回應內容相同。
+    若請求標頭 `Accept: application/vnd.hrm.columns+json`，則以欄位導向格式回傳同一頁資料
+    (`{"columns": {"id": [...], ...}, "next_cursor": ...}`)，不必每筆重複欄位名稱，傳輸量與解析時間較小。
+
+    回應附帶以表格版本號產生的 ETag；`If-None-Match` 相符時直接回傳 304，不執行清單查詢。
+    """
+    conditions = build_employee_filters(department, position, salary_min, salary_max, q)
+    # 先驗證排序參數，串流開始後就無法再回傳 400
+    sort_name, sort_column, descending = parse_sort(sort)
+
+    if NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        return StreamingResponse(stream_employees_ndjson(conditions, sort), media_type=NDJSON_MEDIA_TYPE)
+
+    # 不同格式共用同一 URL，ETag 需依格式區分，並以 Vary 告知快取依 Accept 分開儲存
+    columnar = COLUMNAR_MEDIA_TYPE in request.headers.get("accept", "")
+    etag = f'"employees-v{await read_table_version(session)}{"-columns" if columnar else ""}"'
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    limit = min(limit, EMPLOYEES_PAGE_SIZE_MAX)
+
+    # 快速模式與欄位導向格式只取欄位值 (Row tuple)，不建立 ORM 物件
+    use_rows = EMPLOYEES_FAST_JSON or columnar
+    statement = select(*EMPLOYEE_COLUMNS) if use_rows else select(Employee)
+    # 以 id 作為次要排序鍵，確保排序欄位有重複值時順序仍然穩定
+    if descending:
+        statement = statement.order_by(sort_column.desc(), Employee.id.desc())
+    else:
+        statement = statement.order_by(sort_column, Employee.id)
+    statement = statement.where(*conditions)
+
+    if cursor:
+        position_data = decode_cursor(cursor)
+        after_id = position_data.get("id")
+        if position_data.get("sort") != sort or not isinstance(after_id, int):
+            raise HTTPException(status_code=400, detail="無效的分頁游標。")
+        if sort_name == "id":
+            statement = statement.where(Employee.id < after_id if descending else Employee.id > after_id)
+        else:
+            after_value = position_data.get("value")
+            if not isinstance(after_value, (str, int)):
+                raise HTTPException(status_code=400, detail="無效的分頁游標。")
+            if descending:
+                statement = statement.where(or_(
+                    sort_column < after_value,
+                    and_(sort_column == after_value, Employee.id < after_id),
+                ))
+            else:
+                statement = statement.where(or_(
+                    sort_column > after_value,
+                    and_(sort_column == after_value, Employee.id > after_id),
+                ))
+
+    # 多取一筆以判斷是否還有下一頁
+    employees = (await session.exec(statement.limit(limit + 1))).all()
+    next_cursor = None
+    if len(employees) > limit:
+        employees = employees[:limit]
+        last = employees[-1]
+        next_cursor = encode_cursor({"sort": sort, "value": getattr(last, sort_name), "id": last.id})
+
+    ROWS_RETURNED.labels("/employees").inc(len(employees))
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if columnar:
+        values = list(zip(*employees)) or [()] * len(EMPLOYEE_COLUMNS)
+        columns = {column.name: list(column_values) for column, column_values in zip(EMPLOYEE_COLUMNS, values)}
+        return OrjsonResponse({"columns": columns, "next_cursor": next_cursor}, media_type=COLUMNAR_MEDIA_TYPE, headers=headers)
+    if EMPLOYEES_FAST_JSON:
+        # 直接回傳 Response 時 FastAPI 不會再以 response_model 驗證與序列化
+        return OrjsonResponse({"items": [row._asdict() for row in employees], "next_cursor": next_cursor}, headers=headers)
+    response.headers.update(headers)
+    return EmployeePage(items=employees, next_cursor=next_cursor)
+
+# 須宣告於 /employees/{employee_id} 之前，否則 "changes" 會被當成員工 ID 解析
+@app.get("/employees/changes", response_model=EmployeeChangePage, summary="員工變更紀錄 (增量同步)", tags=["員工管理"])
+async def get_employee_changes(
+    since: Optional[int] = Query(None, ge=0, description="上次同步取得的 last_seq；未提供時只回傳目前最新序號"),
+    limit: int = Query(EMPLOYEE_CHANGES_PAGE_SIZE, ge=1, le=EMPLOYEE_CHANGES_PAGE_SIZE, description="最多回傳筆數"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    回傳序號大於 since 的員工變更 (insert / update / delete)，依序號遞增排列。
+    每筆附上該員工目前的資料 (已刪除時為 null)，依序套用即可讓用戶端資料與伺服器一致，不必重新下載整份清單。
+
+    未提供 since 時不回傳變更，只回傳目前最新序號，作為用戶端載入完整清單前的同步起點。
+    `has_more` 為 true 時以 `last_seq` 繼續查詢。
+    """
+    if since is None:
+        latest = (await session.exec(select(func.max(EmployeeChange.seq)))).first()
+        return EmployeeChangePage(changes=[], last_seq=latest or 0, has_more=False)
+
+    statement = (
+        select(EmployeeChange, Employee)
+        .outerjoin(Employee, Employee.id == EmployeeChange.employee_id)
+        .where(EmployeeChange.seq > since)
+        .order_by(EmployeeChange.seq)
+        .limit(limit + 1)
+    )
+    rows = (await session.exec(statement)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    # SQLite 可能重複使用已刪除的 ID，刪除紀錄一律不附資料，避免誤帶新員工的內容
+    changes = [
+        EmployeeChangeEntry(
+            seq=change.seq, op=change.op, employee_id=change.employee_id,
+            employee=None if change.op == "delete" else employee,
+        )
+        for change, employee in rows
+    ]
+    ROWS_RETURNED.labels("/employees/changes").inc(len(changes))
+    return EmployeeChangePage(changes=changes, last_seq=changes[-1].seq if changes else since, has_more=has_more)
+
+@app.get("/employees/events", summary="員工變更即時推播 (Server-Sent Events)", tags=["員工管理"])
+async def stream_employee_events():
+    """
+    以 SSE 推播員工異動：
+    - `change`：`{"changes": [{"seq", "op", "employee_id", "employee"}]}`，格式與 /employees/changes 相同；
+    - `sync`：異動過多 (例如批次上傳) 或連線跟不上時送出，用戶端應以 /employees/changes 補齊。
+
+    每個連線使用固定大小的佇列，慢速連線不會拖慢寫入或占用無上限的記憶體。
+    推播僅涵蓋目前程序中的寫入；用戶端發現序號不連續時應以變更紀錄補齊。
+    """
+    queue = employee_events.subscribe()
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=EMPLOYEE_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    message = ": keep-alive\n\n"
+                yield message
+        finally:
+            # 用戶端斷線時串流被取消，移除訂閱
+            employee_events.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/employees/{employee_id}", response_model=Employee, summary="獲取單一員工", tags=["員工管理"])
+# ID 型別改為 int
+async def get_employee(employee_id: int, request: Request, session: AsyncSession = Depends(get_async_session)):
+    """
+    根據 ID 獲取特定員工資料 (優先從快取讀取已序列化的資料)。
+    ETag 包含版本號與內容雜湊；`If-None-Match` 相符時回傳 304，快取命中時完全不查詢資料庫。
+    """
+    payload, generation = None, None
+    if employee_cache is not None:
+        payload, generation = await employee_cache.get(employee_id)
+        CACHE_REQUESTS.labels("hit" if payload is not None else "miss").inc()
+
+    if payload is None:
+        # 會話在第一次查詢時才取得連線，快取命中時不佔用連線池
+        employee = await session.get(Employee, employee_id)
+        if not employee:
+            raise HTTPException(status_code=404, detail="Employee not found")
+        payload = employee.model_dump_json()
+        if employee_cache is not None:
+            # 讀取後若有寫入者提交並使該筆失效，set 會略過，不會寫回舊資料
+            await employee_cache.set(employee_id, payload, generation)
+
+    etag = employee_etag(payload)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    ROWS_RETURNED.labels("/employees/{employee_id}").inc()
+    return Response(content=payload, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+# main.py - 調整 POST 路由
+
+@app.post("/employees", response_model=Employee, status_code=201, summary="新增員工", tags=["員工管理"])
+# 使用 EmployeeCreate 作為輸入模型
+async def create_employee(employee: EmployeeCreate, session: AsyncSession = Depends(get_async_session)):
+    """
+    新增一名新員工，員工編號必須唯一。
+    以 `INSERT ... RETURNING` 直接取得資料庫生成的主鍵與預設值，提交後不需再 SELECT 重新整理。
+    """
+    
+    try:
+        statement = insert(Employee).values(**employee.model_dump()).returning(*Employee.__table__.c)
+        row = (await session.exec(statement)).mappings().one()
+        # 回應物件於提交前建立，提交後不再執行可能失敗的步驟
+        new_employee = Employee.model_validate(dict(row))
+        changes = change_entries("insert", [row["id"]])
+        seqs = await record_employee_write_async(session, changes)
+        await session.commit() # 提交事務，寫入資料庫
+    except IntegrityError:
+        # 捕捉資料庫唯一性錯誤
+        await session.rollback()
+        raise HTTPException(status_code=400, detail=f"員工編號 {employee.employee_code} 已存在。")
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"內部資料儲存錯誤: {e}")
+        
+    await invalidate_employee_cache(new_employee.id)
+    publish_employee_changes(changes, seqs, {new_employee.id: new_employee})
+    return new_employee
+
+async def write_employee_update(
+    employee_id: int,
+    values: Dict[str, object],
+    request: Request,
+    response: Response,
+    session: AsyncSession,
+) -> Employee:
+    """
+    以單一 `UPDATE ... RETURNING` 寫入 values 中的欄位並遞增版本號 (PUT 與 PATCH 共用)。
+    若提供 `If-Match` (GET 回應的 ETag)，僅在版本號相符時更新，否則回傳 412，避免覆蓋其他使用者的修改。
+    """
+    expected_version = parse_if_match(request)
+
+    statement = (
+        update(Employee)
+        .where(Employee.id == employee_id)
+        .values(**values, version=Employee.version + 1)
+        .returning(*Employee.__table__.c)
+    )
+    if expected_version is not None:
+        statement = statement.where(Employee.version == expected_version)
+
+    try:
+        row = (await session.exec(statement)).mappings().first()
+        if row is None:
+            await session.rollback()
+            # 僅在失敗時才需要區分「不存在」與「版本不符」
+            if expected_version is not None and await session.get(Employee, employee_id) is not None:
+                raise HTTPException(status_code=412, detail="員工資料已被其他使用者修改，請重新載入後再試。")
+            raise HTTPException(status_code=404, detail="Employee not found")
+        # 回應物件與 ETag 於提交前建立，提交後不再執行可能失敗的步驟
+        updated_employee = Employee.model_validate(dict(row))
+        etag = employee_etag(updated_employee.model_dump_json())
+        changes = change_entries("update", [employee_id])
+        seqs = await record_employee_write_async(session, changes)
+        await session.commit()
+    except IntegrityError:
+        # 捕捉資料庫唯一性錯誤 (員工編號與其他記錄重複)
+        await session.rollback()
+        raise HTTPException(status_code=400, detail=f"新員工編號 {values.get('employee_code')} 已被其他員工使用。")
+    except HTTPException:
+        raise
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"內部資料儲存錯誤: {e}")
+    
+    await invalidate_employee_cache(employee_id)
+    response.headers["ETag"] = etag
+    publish_employee_changes(changes, seqs, {employee_id: updated_employee})
+    return updated_employee
+
+# main.py - 調整 PUT 路由
+
+@app.put("/employees/{employee_id}", response_model=Employee, summary="更新員工", tags=["員工管理"])
+async def update_employee(
+    employee_id: int,
+    employee_update: EmployeeCreate,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    根據 ID 更新現有員工資料 (所有欄位)，員工編號若更改必須保持唯一。
+    以單一 `UPDATE ... RETURNING` 完成；支援 `If-Match` 樂觀鎖 (版本不符回傳 412)。
+    """
+    return await write_employee_update(employee_id, employee_update.model_dump(), request, response, session)
+
+@app.patch("/employees/{employee_id}", response_model=Employee, summary="部分更新員工", tags=["員工管理"])
+async def patch_employee(
+    employee_id: int,
+    employee_patch: EmployeeUpdate,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    僅更新請求中提供的欄位，例如只傳 `{"salary": 65000}` 時只會寫入 salary 欄位。
+    以單一 `UPDATE ... SET <提供的欄位> ... RETURNING` 完成，不先讀取整筆資料；支援 `If-Match` 樂觀鎖。
+    """
+    values = employee_patch.model_dump(exclude_unset=True)
+    if not values:
+        raise HTTPException(status_code=400, detail="請至少提供一個要更新的欄位。")
+    return await write_employee_update(employee_id, values, request, response, session)
+
+def validation_message(exc: ValidationError) -> str:
+    """將 pydantic 驗證錯誤整理為單行訊息 (欄位: 原因)。"""
+    return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in exc.errors())
+
+@app.post("/employees:batch", response_model=EmployeeBatchResponse, summary="批次新增/更新/刪除員工", tags=["員工管理"])
+async def batch_employees(
+    operations: List[EmployeeBatchOperation],
+    response: Response,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    在單一事務中執行多筆 create / update / delete 操作，並逐項回報結果。
+    同類操作以 executemany 一次送出 (依 delete → update → create 的順序執行)，取代逐筆呼叫單筆 API。
+
+    全有或全無：任一項目驗證失敗、目標不存在或員工編號衝突時，整批都不寫入並回傳 400，
+    失敗項目標示對應狀態碼，其餘項目標示 424 (因其他項目失敗而未執行)。
+    """
+    if not operations:
+        raise HTTPException(status_code=400, detail="請至少提供一個操作。")
+    if len(operations) > EMPLOYEES_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"單次批次最多 {EMPLOYEES_BATCH_MAX} 個操作。")
+
+    results = [EmployeeBatchResult(index=index, op=operation.op, status=0, id=operation.id) for index, operation in enumerate(operations)]
+    creates: Dict[int, Dict[str, Any]] = {}
+    updates: Dict[int, Dict[str, Any]] = {}
+    deletes: Dict[int, int] = {}
+
+    def fail(index: int, status: int, error: str):
+        results[index].status = status
+        results[index].error = error
+
+    # 1. 逐項驗證輸入 (欄位規則與單筆 API 相同；新增項目另以 Employee 模型檢查資料表層級的限制，例如薪資必須大於 0)
+    for index, operation in enumerate(operations):
+        try:
+            if operation.op == "create":
+                employee = Employee.model_validate(EmployeeCreate.model_validate(operation.data or {}))
+                creates[index] = employee.model_dump(include=set(EMPLOYEE_DATA_COLUMNS))
+            elif operation.id is None:
+                fail(index, 422, "update / delete 操作必須提供 id。")
+            elif operation.op == "update":
+                values = EmployeeUpdate.model_validate(operation.data or {}).model_dump(exclude_unset=True)
+                if values:
+                    updates[index] = values
+                else:
+                    fail(index, 422, "請至少提供一個要更新的欄位。")
+            else:
+                deletes[index] = operation.id
+        except ValidationError as exc:
+            fail(index, 422, validation_message(exc))
+
+    # 2. 目標員工必須存在，且同一批次中不可重複操作同一員工
+    targets = Counter(operations[index].id for index in [*updates, *deletes])
+    existing_ids = set()
+    if targets:
+        existing_ids = set((await session.exec(select(Employee.id).where(Employee.id.in_(targets)))).all())
+    for index in [*updates, *deletes]:
+        target_id = operations[index].id
+        if target_id not in existing_ids:
+            fail(index, 404, "Employee not found")
+        elif targets[target_id] > 1:
+            fail(index, 422, f"同一批次中重複操作員工 {target_id}。")
+
+    # 3. 員工編號唯一性 (刪除先執行，因此被刪除員工的編號可供重複使用)
+    claims = {index: values["employee_code"] for index, values in [*creates.items(), *updates.items()] if "employee_code" in values}
+    claim_counts = Counter(claims.values())
+    holders: Dict[str, int] = {}
+    if claims:
+        holders = dict((await session.exec(
+            select(Employee.employee_code, Employee.id).where(Employee.employee_code.in_(set(claims.values())))
+        )).all())
+    deleted_ids = set(deletes.values())
+    for index, code in claims.items():
+        holder = holders.get(code)
+        if claim_counts[code] > 1:
+            fail(index, 400, f"員工編號 {code} 在同一批次中重複。")
+        elif holder is not None and holder != operations[index].id and holder not in deleted_ids:
+            fail(index, 400, f"員工編號 {code} 已被其他員工使用。")
+
+    failed = sum(1 for result in results if result.status)
+    if failed:
+        for result in results:
+            if not result.status:
+                result.status = 424
+        response.status_code = 400
+        return EmployeeBatchResponse(committed=False, message=f"{failed} 個操作失敗，整批未寫入。", results=results)
+
+    # 4. 以 executemany 依操作類型批次執行
+    table = Employee.__table__
+    try:
+        if deletes:
+            await session.exec(delete(table).where(table.c.id.in_(deleted_ids)))
+
+        # 部分更新的欄位組合可能不同，相同欄位組合的更新合併為一次 executemany
+        update_groups: Dict[tuple, List[Dict[str, Any]]] = {}
+        for index, values in updates.items():
+            update_groups.setdefault(tuple(sorted(values)), []).append({"target_id": operations[index].id, **values})
+        for params in update_groups.values():
+            statement = update(table).where(table.c.id == bindparam("target_id")).values(version=table.c.version + 1)
+            await session.exec(statement, params=params)
 
+        if creates:
+            statement = table.insert().returning(table.c.id, sort_by_parameter_order=True)
+            new_ids = (await session.exec(statement, params=list(creates.values()))).scalars().all()
+            for index, new_id in zip(creates, new_ids):
+                results[index].id = new_id
+
+        written_ids = [results[index].id for index in [*creates, *updates]]
+        written = {}
+        if written_ids:
+            written = {employee.id: employee for employee in (await session.exec(select(Employee).where(Employee.id.in_(written_ids)))).all()}
+        changes = (
+            change_entries("delete", deletes.values())
+            + change_entries("update", (operations[index].id for index in updates))
+            + change_entries("insert", (results[index].id for index in creates))
+        )
+        seqs = await record_employee_write_async(session, changes)
+        await session.commit()
+    except IntegrityError:
+        # 預先檢查未涵蓋的衝突 (例如批次內互換員工編號)
+        await session.rollback()
+        for result in results:
+            result.status = 400
+        response.status_code = 400
+        return EmployeeBatchResponse(committed=False, message="批次寫入違反唯一性限制，整批未寫入。", results=results)
+    except Exception as e:
+        await session.rollback()
+        raise HTTPException(status_code=500, detail=f"內部資料儲存錯誤: {e}")
+
+    for index in creates:
+        results[index].status = 201
+        results[index].employee = written.get(results[index].id)
+    for index in updates:
+        results[index].status = 200
+        results[index].employee = written.get(results[index].id)
+    for index in deletes:
+        results[index].status = 204
+    for target_id in targets:
+        await invalidate_employee_cache(target_id)
+    publish_employee_changes(changes, seqs, written)
+    return EmployeeBatchResponse(
+        committed=True,
+        message=f"批次完成。新增 {len(creates)} 筆、更新 {len(updates)} 筆、刪除 {len(deletes)} 筆。",
+        results=results,
+    )
+
+# main.py - 調整 DELETE 路由
+
+@app.delete("/employees/{employee_id}", status_code=204, summary="刪除員工", tags=["員工管理"])
+async def delete_employee(employee_id: int, session: AsyncSession = Depends(get_async_session)):
+    """根據 ID 刪除特定員工。以單一 `DELETE ... RETURNING id` 完成，不先讀取整筆資料。"""
+    
+    deleted_id = (await session.exec(delete(Employee).where(Employee.id == employee_id).returning(Employee.id))).scalar()
+    if deleted_id is None:
+        await session.rollback()
+        raise HTTPException(status_code=404, detail="Employee not found")
+    
+    changes = change_entries("delete", [employee_id])
+    seqs = await record_employee_write_async(session, changes)
+    await session.commit()
+    await invalidate_employee_cache(employee_id)
+    publish_employee_changes(changes, seqs, {})
+    
+    # 返回 204 No Content
+    return
+
+@app.delete("/employees", response_model=EmployeeBulkDeleteResult, summary="批次刪除員工", tags=["員工管理"])
+async def delete_employees(
+    ids: Optional[List[int]] = Query(None, description="要刪除的員工 ID，可重複指定 (ids=1&ids=2)"),
+    department: Optional[str] = Query(None, description="部門 (完全相符)"),
+    position: Optional[str] = Query(None, description="職位 (完全相符)"),
+    salary_min: Optional[int] = Query(None, ge=0, description="最低薪資 (含)"),
+    salary_max: Optional[int] = Query(None, ge=0, description="最高薪資 (含)"),
+    q: Optional[str] = Query(None, description="姓名或員工編號的前綴搜尋"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    依 ID 清單或篩選條件 (與 GET /employees 相同) 批次刪除員工，條件同時提供時需全部符合。
+    以單一 `DELETE ... WHERE ... RETURNING id` 完成並回傳被刪除的 ID；沒有任何資料符合時回傳 404。
+    為避免誤刪整張表格，至少需要提供一個條件。
+    """
+    filters = build_employee_filters(department, position, salary_min, salary_max, q)
+    conditions = [*filters, Employee.id.in_(ids)] if ids else filters
+    if not conditions:
+        raise HTTPException(status_code=400, detail="請提供 ids 或至少一個篩選條件。")
+
+    deleted_ids = (await session.exec(delete(Employee).where(*conditions).returning(Employee.id))).scalars().all()
+    if not deleted_ids:
+        await session.rollback()
+        raise HTTPException(status_code=404, detail="沒有符合條件的員工。")
+
+    changes = change_entries("delete", deleted_ids)
+    seqs = await record_employee_write_async(session, changes)
+    await session.commit()
+    if filters:
+        # 依篩選條件刪除的筆數可能很多，直接清空快取
+        await invalidate_employee_cache()
+    else:
+        for employee_id in deleted_ids:
+            await invalidate_employee_cache(employee_id)
+    publish_employee_changes(changes, seqs, {})
+    return EmployeeBulkDeleteResult(deleted=len(deleted_ids), ids=sorted(deleted_ids))
+
+# main.py - 調整 POST /upload 批次上傳路由
+
+@app.post("/upload", summary="批次上傳 CSV 格式文件", tags=["批次處理"])
+# 使用同步 def：FastAPI 會在執行緒池中執行，解析與寫入不會阻塞事件迴圈上的其他請求
+def bulk_upload(
+    file: UploadFile = File(...),
+    mode: Literal["insert", "upsert"] = Query("insert", description="insert：僅新增；upsert：依員工編號新增或更新"),
+    batch_size: Optional[int] = Query(None, ge=1, description="每 N 筆提交一次；未指定時整份檔案於單一事務中提交"),
+    atomic: bool = Query(False, description="搭配 batch_size：分批寫入暫存表，最後一次合併 (全有或全無)"),
+    session: Session = Depends(get_session),
+):
+    """
+    處理上傳的檔案。使用單一事務處理；員工編號與既有資料衝突的列會逐列回報並略過，其餘資料一次提交。
+    通過驗證的資料以批次方式寫入 (PostgreSQL 使用 COPY，其他資料庫使用多列 INSERT)。
+    檔案以串流方式逐段解碼與解析，記憶體用量不隨檔案大小增加。
+
+    `mode=upsert` 時以員工編號為鍵：不存在則新增、內容有變更則更新、完全相同則不寫入，
+    並回傳 inserted / updated / unchanged 筆數 (適用於定期同步完整名冊)。
+
+    指定 `batch_size` 時每 N 筆提交一次，限制單一事務的大小；中途失敗時已提交的批次會保留。
+    若同時指定 `atomic=true`，各批次改為提交至暫存表，全部讀取完成後才以單一事務合併至員工表格。
+    """
+    # 直接包裝暫存檔 (SpooledTemporaryFile)：逐段讀取並以增量解碼器解碼，
+    # utf-8-sig 會移除 Excel 產生的 BOM；newline='' 讓 csv 模組正確處理欄位內換行
+    file.file.seek(0)
+    text_stream = TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    try:
+        return process_upload_stream(csv.reader(text_stream), session, mode, None, batch_size, atomic)
+    finally:
+        # 解除包裝，避免關閉 UploadFile 自身管理的暫存檔
+        text_stream.detach()
+
+def process_upload_stream(
+    csv_reader,
+    session: Session,
+    mode: str = "insert",
+    error_entries: Optional[list] = None,
+    batch_size: Optional[int] = None,
+    atomic: bool = False,
+) -> dict:
+    """
+    解析並寫入 CSV 資料列，回傳上傳結果。
+    error_entries 可由呼叫端提供，以便在處理期間即時查看錯誤 (背景匯入工作使用)。
+    """
+    if mode == "upsert" and engine.dialect.name not in ("postgresql", "sqlite"):
+        raise HTTPException(status_code=400, detail=f"目前的資料庫 ({engine.dialect.name}) 不支援 upsert 模式。")
 
-    # 7. 嘗試提交所有成功的記錄
     try:
+        header = next(csv_reader) # 假設第一行是標頭
+    except StopIteration:
+        raise HTTPException(status_code=400, detail="檔案內容為空。")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="檔案編碼錯誤，請確保使用 UTF-8 編碼。")
+
+    if len(header) < UPLOAD_EXPECTED_COLUMNS:
+        raise HTTPException(status_code=400, detail="檔案標頭不完整，預期欄位：姓名 (Name), 員工編號 (Code), 職位 (Position), 部門 (Department), 薪資 (Salary)。")
+
+    if error_entries is None:
+        error_entries = []
+
+    # 寫入的員工逐批記錄於變更暫存表，提交前才轉存為變更紀錄 (記憶體用量不隨檔案大小成長)
+    def write(rows) -> Dict[str, int]:
+        if mode == "upsert":
+            return upsert_employees_bulk(session, rows)
+        return {"inserted": insert_employees_bulk(session, rows, error_entries)}
+
+    def commit():
+        record_employee_write(session)
         session.commit()
+
+    # 驗證與寫入同步進行：validate_upload_rows 逐列產生通過驗證的資料，錯誤則記錄於 error_entries
+    started = time.perf_counter()
+    counts = Counter()
+    import_id = None
+    try:
+        rows = validate_upload_rows(csv_reader, error_entries)
+        if batch_size and atomic:
+            # 分批提交至暫存表，最後以單一事務合併
+            import_id = uuid.uuid4().hex
+            for chunk in iter_chunks(rows, batch_size):
+                stage_employees(session, import_id, chunk)
+                session.commit()
+            counts.update(merge_staged_employees(session, import_id, mode, error_entries))
+            commit()
+        elif batch_size:
+            # 每批各自提交，counts 只累計已提交的批次
+            for chunk in iter_chunks(rows, batch_size):
+                chunk_counts = write(chunk)
+                commit()
+                counts.update(chunk_counts)
+        else:
+            counts.update(write(rows))
+            # 版本號在提交前才遞增，縮短持有該列鎖的時間
+            commit()
+    except UnicodeDecodeError:
+        # 解碼於串流讀取時進行，檔案後段的編碼錯誤會在寫入過程中發現
+        session.rollback()
+        if import_id:
+            discard_staged_employees(import_id)
+        committed = sum(counts.values())
+        if committed:
+            invalidate_employee_cache_from_thread()
+            employee_events.publish(SYNC_EVENT)
+            raise HTTPException(status_code=400, detail=f"檔案編碼錯誤，請確保使用 UTF-8 編碼。先前已提交的 {committed} 筆記錄已保留。")
+        raise HTTPException(status_code=400, detail="檔案編碼錯誤，請確保使用 UTF-8 編碼。")
     except IntegrityError:
-        # 如果批次中有員工編號與既有資料庫記錄衝突，則整批資料撤銷
+        # 寫入前已排除既有編號；此處僅在檢查後被其他請求搶先寫入同一編號時發生，撤銷尚未提交的資料
         session.rollback()
+        if import_id:
+            discard_staged_employees(import_id)
+        committed = sum(counts.values())
+        if committed:
+            invalidate_employee_cache_from_thread()
+            employee_events.publish(SYNC_EVENT)
+            return {"message": f"批次上傳中斷。員工編號與既有資料庫記錄衝突，先前已提交的 {committed} 筆記錄已保留，其餘記錄已撤銷。",
+                    "successful_uploads": committed,
+                    "errors": [{"row": "Batch Error", "error": "批次中有員工編號與既有資料庫記錄衝突，尚未提交的記錄已撤銷。", "data": "N/A"}] + error_entries}
         # 為了簡化，直接將所有記錄視為失敗
         return {"message": "批次上傳失敗。批次中至少一筆記錄的員工編號與既有資料庫記錄衝突，所有記錄已撤銷。", 
                 "successful_uploads": 0, 
                 "errors": [{"row": "Batch Error", "error": "批次中有員工編號與既有資料庫記錄衝突，所有記錄已撤銷。", "data": "N/A"}] + error_entries}
+    except HTTPException:
+        # 寫入過程中主動回報的錯誤 (例如 400) 保留原狀態碼，不轉為 500
+        session.rollback()
+        if import_id:
+            discard_staged_employees(import_id)
+        raise
     except Exception as e:
         session.rollback()
+        if import_id:
+            discard_staged_employees(import_id)
         raise HTTPException(status_code=500, detail=f"批次資料庫儲存錯誤: {e}")
 
 
+    # 驗證錯誤與衝突錯誤分別於不同階段產生，依列號排序後回傳
+    error_entries.sort(key=lambda entry: entry["row"])
+    success_count = sum(counts.values())
+    # 批次寫入 (特別是 upsert) 可能改動任意員工，直接清空快取
+    if success_count:
+        invalidate_employee_cache_from_thread()
+        employee_events.publish(SYNC_EVENT)
+
+    elapsed = time.perf_counter() - started
+    UPLOAD_ROWS.labels(mode, "success").inc(success_count)
+    UPLOAD_ROWS.labels(mode, "error").inc(len(error_entries))
+    UPLOAD_THROUGHPUT.labels(mode).observe((success_count + len(error_entries)) / max(elapsed, 1e-6))
+    if mode == "upsert":
+        counts = {key: counts[key] for key in ("inserted", "updated", "unchanged")}
+        message = (f"批次同步完成。新增 {counts['inserted']} 筆、更新 {counts['updated']} 筆、"
+                   f"未變更 {counts['unchanged']} 筆記錄。")
+        return {"message": message, "successful_uploads": success_count, **counts, "errors": error_entries}
+
     message = f"批次上傳完成。成功新增 {success_count} 筆記錄。"
-    return {"message": message, "successful_uploads": success_count, "errors": error_entries}
\ No newline at end of file
+    return {"message": message, "successful_uploads": success_count, "errors": error_entries}
+
+@app.post("/upload/jobs", response_model=UploadJob, status_code=202, summary="建立背景批次上傳工作", tags=["批次處理"])
+def create_upload_job(
+    file: UploadFile = File(...),
+    mode: Literal["insert", "upsert"] = Query("insert", description="insert：僅新增；upsert：依員工編號新增或更新"),
+    batch_size: Optional[int] = Query(None, ge=1, description="每 N 筆提交一次；未指定時整份檔案於單一事務中提交"),
+    atomic: bool = Query(False, description="搭配 batch_size：分批寫入暫存表，最後一次合併 (全有或全無)"),
+):
+    """
+    將上傳檔案暫存至磁碟後立即回傳工作 ID，由背景工作執行緒分批處理。
+    處理規則與 `POST /upload` 相同；以 `GET /upload/jobs/{job_id}` 查詢進度與結果。
+    """
+    job = UploadJob(
+        id=uuid.uuid4().hex, mode=mode, batch_size=batch_size, atomic=atomic,
+        filename=file.filename, created_at=datetime.now(timezone.utc), owner=UPLOAD_JOB_OWNER,
+    )
+    job.heartbeat_at = job.created_at
+
+    # 複製至獨立暫存檔：請求結束後 UploadFile 的暫存檔即會關閉
+    file.file.seek(0)
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_JOB_DIR, prefix="hrm_upload_", suffix=".csv", delete=False) as spooled:
+        shutil.copyfileobj(file.file, spooled)
+        job.bytes_total = spooled.tell()
+
+    register_upload_job(job)
+    running_upload_jobs[job.id] = job
+    upload_job_executor.submit(run_upload_job, job, spooled.name)
+    return job
+
+@app.get("/upload/jobs/{job_id}", response_model=UploadJob, summary="查詢背景批次上傳工作", tags=["批次處理"])
+def get_upload_job(job_id: str, session: Session = Depends(get_session)):
+    """返回背景匯入工作的狀態、進度、吞吐量與逐列錯誤。"""
+    job = running_upload_jobs.get(job_id)
+    if job:
+        # 背景執行緒可能仍在累積錯誤，回傳當下的快照
+        return job.model_dump()
+    job = session.get(UploadJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    # 由其他程序負責的工作：若該程序已中止則標記為失敗，避免狀態永遠停在處理中
+    fail_stale_upload_jobs(session, [job])
+    return job